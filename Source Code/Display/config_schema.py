@@ -0,0 +1,175 @@
+# Declarative configuration files, shared by the light control server and the creator panel.
+# A schema lists every key a config file can have, with how its value is converted and checked. Loading a file gives
+# a frozen config object with one attribute per key (dashes and dots become underscores), so reading a value is a plain
+# attribute access instead of a dictionary lookup.
+# Values can be overridden by '*.conf' files in a directory named after the config file with '.d' added, which are read
+# in alphabetical order. That way, changes for one room or machine don't need to touch the main file.
+import os, re, glob, math
+
+# Default of settings that must be set
+REQUIRED = object()
+
+
+# Raised when a config file can't be loaded, with the file and line that caused it when they're known
+class configError(Exception):
+  def __init__(self, message, origin=None):
+    super().__init__(message)
+    self.message = message
+    self.origin = origin
+
+  def __str__(self):
+    if self.origin == None:
+      return self.message
+    return f"{self.origin[0]}:{self.origin[1]}: {self.message}"
+
+
+# Converters for setting values. They raise ValueError with a short explanation if a value is invalid.
+
+def integer(minimum=None, maximum=None):
+  def convert(value):
+    value = int(value)
+    if (minimum != None and value < minimum) or (maximum != None and value > maximum):
+      raise ValueError(f"must be between {minimum} and {maximum}" if maximum != None else f"must be at least {minimum}")
+    return value
+  return convert
+
+def number(minimum=None):
+  def convert(value):
+    value = float(value)
+    if not math.isfinite(value):
+      raise ValueError("must be a finite number")
+    if minimum != None and value < minimum:
+      raise ValueError(f"must be at least {minimum}")
+    return value
+  return convert
+
+def choice(*options):
+  def convert(value):
+    if value not in options:
+      raise ValueError(f"must be one of {', '.join(options)}")
+    return value
+  return convert
+
+# Comma separated list, without empty entries
+def listing(value):
+  items = [item.strip() for item in value.split(',') if item.strip() != ""]
+  if len(items) == 0:
+    raise ValueError("must list at least one value")
+  return items
+
+# Network port
+port = integer(0, 65535)
+
+
+# One key of a config file.
+# Keys with a '*' in them (like 'zone.*.serial') match any name in its place. Their values are collected in a dictionary
+# attribute, keyed by that name; if 'field' is given, each name gets a dictionary of fields instead (like zones['a']['serial']).
+class setting():
+  def __init__(self, key, convert=str, default=REQUIRED, description="", attribute=None, field=None):
+    self.key = key
+    self.convert = convert
+    self.default = default
+    self.description = description
+    self.field = field
+    self.attribute = attribute if attribute != None else re.sub(r"[^A-Za-z0-9_]", "_", key)
+    self.pattern = None
+    if '*' in key:
+      self.pattern = re.compile(re.escape(key).replace(r"\*", r"([A-Za-z0-9_-]+)"))
+
+
+# Base of the classes made for each schema. Attributes can't be changed once the config is loaded.
+class configObject():
+  __slots__ = ("values", "origins")
+
+  def __setattr__(self, name, value):
+    raise AttributeError("configuration is read-only")
+
+  def __delattr__(self, name):
+    raise AttributeError("configuration is read-only")
+
+  # Returns the file and line where a key was set, or None if it has its default value
+  def origin(self, key):
+    return self.origins.get(key)
+
+  # Returns the values of all keys that were set in the config files, for logging
+  def items(self):
+    return list(self.values.items())
+
+
+# List of settings a config file can have, and checks that involve more than one setting.
+# Checks are functions that get the loaded config object, and raise configError if something is wrong.
+class schema():
+  def __init__(self, name, settings, checks=()):
+    self.settings = settings
+    self.checks = checks
+    self.exact = {item.key: item for item in settings if item.pattern == None}
+    self.patterns = [item for item in settings if item.pattern != None]
+    attributes = tuple(dict.fromkeys(item.attribute for item in settings))
+    self.config_class = type(name, (configObject,), {"__slots__": attributes})
+
+  # Loads a config file and its overrides. Returns the config object, or raises configError.
+  def load(self, path):
+    if not os.path.exists(path):
+      raise configError(f"Configuration file '{path}' doesn't exist")
+    values = dict()
+    # Later files override earlier ones
+    for file_path in [path] + sorted(glob.glob(os.path.join(path+".d", "*.conf"))):
+      self.__read(file_path, values)
+
+    config = object.__new__(self.config_class)
+    set_attribute = object.__setattr__
+    for item in self.settings:
+      if item.pattern == None:
+        if item.key in values:
+          set_attribute(config, item.attribute, values[item.key][0])
+        elif item.default is REQUIRED:
+          raise configError(f"Missing required value '{item.key}' in '{path}'")
+        else:
+          set_attribute(config, item.attribute, item.default)
+      elif not hasattr(config, item.attribute):
+        set_attribute(config, item.attribute, dict())
+    # Collect values of keys with names in them
+    for key, (value, origin) in values.items():
+      for item in self.patterns:
+        match = item.pattern.fullmatch(key)
+        if match == None:
+          continue
+        collected = getattr(config, item.attribute)
+        if item.field == None:
+          collected[match.group(1)] = value
+        else:
+          collected.setdefault(match.group(1), dict())[item.field] = value
+        break
+    set_attribute(config, "values", {key: value for key, (value, origin) in values.items()})
+    set_attribute(config, "origins", {key: origin for key, (value, origin) in values.items()})
+    for check in self.checks:
+      check(config)
+    return config
+
+  # Reads one file, converting values as they're read so that errors point to the right line
+  def __read(self, path, values):
+    with open(path, 'r') as config_f:
+      for line_number, line in enumerate(config_f, 1):
+        separator = line.find('=')
+        # Skip line if it doesn't follow the format 'key=value'
+        if separator == -1:
+          continue
+        key = line[0:separator].strip()
+        value = line[separator+1:].strip()
+        item = self.exact.get(key)
+        if item == None:
+          item = next((item for item in self.patterns if item.pattern.fullmatch(key)), None)
+        if item == None:
+          print(f"{path}:{line_number}: Unused value '{line.strip()}' found in config file")
+          continue
+        try:
+          values[key] = (item.convert(value), (path, line_number))
+        except ValueError as e:
+          raise configError(f"Invalid value for '{key}': {e}", (path, line_number))
+
+  # Returns the keys and descriptions of required and optional settings, for showing when a config file can't be loaded
+  def help(self):
+    required = [item for item in self.settings if item.default is REQUIRED and item.pattern == None]
+    optional = [item for item in self.settings if item not in required]
+    describe = lambda item: (item.key.replace('*', "<name>"), item.description)
+    return [describe(item) for item in required], [describe(item) for item in optional]
@@ -1,70 +1,25 @@
 #!/bin/python3 
-import os, sys, time, math
-from threading import Thread, Lock
+import time
+# Used to measure how long startup takes
+STARTUP_TIME = time.perf_counter()
+import sys, html
 from PySide2.QtWidgets import QApplication, QWidget, QHBoxLayout, QVBoxLayout, QLabel, QTextEdit, QPushButton, QMessageBox, QDialog, QListWidget
 from PySide2.QtGui import Qt
-from http.client import HTTPConnection
+from PySide2.QtCore import QTimer, Signal
+import game_core
+from game_core import CONFIG_PATH, CONFIG_SCHEMA, SLIDESHOWS, gameEngine, engineBusy, stateEvent, tickEvent, historyEvent, healthEvent
 
-CONFIG_PATH = "creator_panel.conf"
-config = dict()
 
-
-# Load configuration file
-def load_config():
-  global config
-  
-  # Abort if config file doesn't exist
-  if not os.path.exists(CONFIG_PATH):
-    return False
-  
-  check_interval_set = False
-  address_set        = False
-  port_set           = False
-  
-  # Read config file
-  with open(CONFIG_PATH,'r') as config_f:
-    for line in config_f.readlines():
-      separator = line.find('=')
-      # Skip line if it doesn't follow the format 'key=value'
-      if separator==-1:
-        continue
-      # Split each line to key and value
-      key = line[0:separator].strip()
-      value = line[separator+1:].strip()
-      config[key] = value
-      # Check if this is one of the required keys
-      if key=="check-interval":
-        check_interval_set = True
-      elif key=="address":
-        address_set = True
-      elif key=="port":
-        port_set = True
-  # Abort if not all required values were set
-  if not (check_interval_set and address_set and port_set):
-    return False
-  
-  # Convert transition time to an floating point number, or abort if it's invalid or out of range
-  # Also convert color hexcodes to color classes, and port to integer
-  try:
-    config["check-interval"] = int(config["check-interval"])
-    config["port"] = int(config["port"])
-  except:
-    return False
-  
-  # Abort if port out of range
-  if config["port"]<0 or config["port"]>65535:
-    return False
-  
-  # Everything was successful
-  return True
-
-
-# Window class
+# Window class, a front-end of the game engine. It shows the engine's events and sends it the user's actions.
 class mainWindow(QWidget):
-  def __init__(self):
+  # Engine events arrive from the engine's threads, so they're passed to the GUI thread through these
+  stateChanged = Signal(object)
+  historyAdded = Signal(object)
+  healthChanged = Signal(object)
+  
+  def __init__(self, engine):
     super().__init__()
-    self.lock = Lock()
-    self.uilock = Lock()
+    self.engine = engine
     # Set main window properties
     self.setWindowTitle("Escape Room - Creator Panel")
     self.resize(410,0)
@@ -88,6 +43,12 @@ class mainWindow(QWidget):
     self.infoLayout.addWidget(self.score)
     self.score.setTextFormat(Qt.RichText)
     self.score.setText("<b>Score:</b>")
+    # Light control server status
+    self.lightStatus = QLabel(self)
+    self.infoLayout.addWidget(self.lightStatus)
+    self.lightStatus.setTextFormat(Qt.RichText)
+    self.lightStatus.setWordWrap(True)
+    self.lightStatus.setText("<b>Lights:</b> <font color='gray'>Checking...</font>")
     # History
     self.history = QTextEdit(self)
     self.infoLayout.addWidget(self.history)
@@ -132,7 +93,28 @@ class mainWindow(QWidget):
     self.slideshowButton.setText("Slideshow")
     self.buttonLayout.addStretch()
     
-    # Slideshow dialog
+    # Slideshow dialog is only built the first time it's needed
+    self.slideshowDialog = None
+    
+    # Set up slots and signals
+    self.startButton.clicked.connect(self.startSignal)
+    self.resetButton.clicked.connect(self.resetSignal)
+    self.addHintButton.clicked.connect(self.hintAddSignal)
+    self.removeHintButton.clicked.connect(self.hintRemoveSignal)
+    self.victoryLightsButton.clicked.connect(self.victoryLightsSignal)
+    self.resetLightsButton.clicked.connect(self.resetLightsSignal)
+    self.screenBlankButton.clicked.connect(self.screenBlankSignal)
+    self.slideshowButton.clicked.connect(self.openSlideshowDialog)
+    self.stateChanged.connect(self.updateUi)
+    self.historyAdded.connect(self.historyShow)
+    self.healthChanged.connect(self.healthShow)
+    engine.subscribe(stateEvent, self.stateChanged.emit)
+    engine.subscribe(tickEvent, self.stateChanged.emit)
+    engine.subscribe(historyEvent, self.historyAdded.emit)
+    engine.subscribe(healthEvent, self.healthChanged.emit)
+  
+  # Builds slideshow dialog
+  def buildSlideshowDialog(self):
     self.slideshowDialog = QDialog(self)
     self.slideshowDialog.setWindowTitle("Select slideshow")
     self.slideshowDialog.resize(250,100)
@@ -140,8 +122,8 @@ class mainWindow(QWidget):
     # List
     self.slideshowDialog.list = QListWidget(self.slideshowDialog)
     self.slideshowDialog.mainLayout.addWidget(self.slideshowDialog.list)
-    self.slideshowDialog.list.addItem("Item 8 Hint 1")
-    self.slideshowDialog.list.addItem("Item 8 Hint 2")
+    for description in SLIDESHOWS.values():
+      self.slideshowDialog.list.addItem(description)
     self.slideshowDialog.list.setCurrentRow(0)
     # Buttons
     self.slideshowDialog.buttonLayout = QHBoxLayout(self.slideshowDialog)
@@ -159,425 +141,131 @@ class mainWindow(QWidget):
     self.slideshowDialog.cancelButton = QPushButton(self)
     self.slideshowDialog.buttonLayout.addWidget(self.slideshowDialog.cancelButton)
     self.slideshowDialog.cancelButton.setText("Cancel")
-    
     # Set up slots and signals
-    self.startButton.clicked.connect(self.startSignal)
-    self.resetButton.clicked.connect(self.resetSignal)
-    self.addHintButton.clicked.connect(self.hintAddSignal)
-    self.removeHintButton.clicked.connect(self.hintRemoveSignal)
-    self.victoryLightsButton.clicked.connect(self.victoryLightsSignal)
-    self.resetLightsButton.clicked.connect(self.resetLightsSignal)
-    self.screenBlankButton.clicked.connect(self.screenBlankSignal)
-    self.slideshowButton.clicked.connect(self.slideshowDialog.exec_)
     self.slideshowDialog.OKButton.clicked.connect(self.slideshowDialog.accept)
     self.slideshowDialog.cancelButton.clicked.connect(self.slideshowDialog.reject)
     self.slideshowDialog.accepted.connect(self.sendSlideshow)
     self.slideshowDialog.spaceButton.clicked.connect(self.slideshowSpacebarSignal)
   
-  # Updates UI with given time and hint data
-  def updateUi(self, start, pause, hints, update_all=False):
-    if update_all:
-      self.uilock.acquire()
-    # Timer hasn't started
-    if start==0:
-      t=0
-      if update_all:
+  # Shows slideshow dialog, building it if this is the first time
+  def openSlideshowDialog(self):
+    if self.slideshowDialog == None:
+      self.buildSlideshowDialog()
+    self.slideshowDialog.exec_()
+  
+  # Updates UI with the timer's state
+  def updateUi(self, state):
+    # Button text only changes when the state is read, not on every tick
+    if type(state)==stateEvent:
+      if state.start==0:
         self.startButton.setText("Start")
-    # Timer is started but not paused
-    elif pause==0:
-      t = math.floor(time.time()*10) - start
-      if update_all:
+      elif state.pause==0:
         self.startButton.setText("Pause")
-    # Timer is paused
-    else:
-      t = pause-start
-      if update_all:
+      else:
         self.startButton.setText("Resume")
-    if update_all:
-      self.uilock.release()
-    
-    # Create human readable time string
-    hours = str(t//36000)
-    mins  = str((t//600)%60).zfill(2)
-    secs  = str((t//10)%60).zfill(2)
-    time_str = f"{hours}:{mins}:{secs}"
-    
-    # Store time string for use by other functions
-    self.lock.acquire()
-    self.time_str = time_str
-    self.lock.release()
-    # Calculate score
-    if t==0 or hints<0:
-      score = "N/A"
-    else:
-      score = str(round(10000000/(t*((hints/4)+1)),3))
     # Set display text
-    self.uilock.acquire()
-    self.time.setText(f"<b>Time:</b> {time_str} ({str(t/10)}s)")
-    self.hints.setText(f"<b>Hints:</b> {str(hints)}")
-    self.score.setText(f"<b>Score:</b> {score}")
-    self.uilock.release()
+    self.time.setText(f"<b>Time:</b> {state.time_str} ({str(state.time/10)}s)")
+    self.hints.setText(f"<b>Hints:</b> {str(state.hints)}")
+    self.score.setText(f"<b>Score:</b> {state.score}")
+  
+  # Shows action in history
+  def historyShow(self, event):
+    self.history.append(event.html)
   
-  # Adds action to history
-  def historyAdd(self, text):
-    self.lock.acquire()
-    gametime_str = self.time_str
-    self.lock.release()
-    timestamp = time.strftime(f"<i><font color='gray'>%H:%M sys, </font></i><font color='#007FFF'>{gametime_str} game</font> ")
-    self.uilock.acquire()
-    self.history.append(timestamp+text)
-    self.uilock.release()
+  # Shows whether the light control server is working
+  def healthShow(self, event):
+    status_color = "green" if event.ok else "red"
+    self.lightStatus.setText(f"<b>Lights:</b> <font color='{status_color}'>{event.detail}</font>")
   
   # Signal handlers
   def startSignal(self):
-    self.historyAdd("Toggled <b>timer</b>.")
-    self.start_pointer()
-    self.ledstrip_send_pointer("base")
+    self.engine.toggleTimer()
   
   def resetSignal(self):
-    self.historyAdd("<b>Reset</b>.")
-    self.reset_pointer()
-    self.ledstrip_send_pointer("base")
+    self.engine.reset()
   
   def hintAddSignal(self):
-    self.historyAdd("Added <b>hint</b>.")
-    self.hintadd_pointer()
-    self.ledstrip_send_pointer("hint")
+    self.engine.addHint()
   
   def hintRemoveSignal(self):
-    self.historyAdd("Removed <b>hint</b>.")
-    self.hintremove_pointer()
+    self.engine.removeHint()
   
   def victoryLightsSignal(self):
-    self.historyAdd("Set victory <b>lights</b>.")
-    self.ledstrip_send_pointer("victory")
+    self.engine.victoryLights()
   
   def resetLightsSignal(self):
-    self.historyAdd("Reset <b>lights</b>.")
-    self.ledstrip_send_pointer("base")
+    self.engine.resetLights()
   
   def screenBlankSignal(self):
-    self.historyAdd("Blanked <b>screen</b>.")
-    self.ledstrip_send_pointer("blank")
+    self.engine.blankScreen()
   
   def sendSlideshow(self):
-    command = ["8.1", "8.2"]
     pos = self.slideshowDialog.list.currentRow()
-    self.historyAdd(f"Sent <b>slideshow</b> {command[pos]}.")
-    self.ledstrip_send_pointer(f"show-{command[pos]}")
+    self.engine.sendSlideshow(list(SLIDESHOWS)[pos])
   
   def slideshowSpacebarSignal(self):
-    self.ledstrip_send_pointer("space")
+    self.engine.pressSpace()
   
-  # Halts time watch object when app is closing
+  # Halts the game engine when app is closing, which makes sure the journal is written
   def closeEvent(self,e):
-    self.timewatch_halt_pointer()
-
-
-# Class that handles reading and modifying files which hold time/hint data
-class timeWatch():
-  def __init__(self):
-    self.lock = Lock()
-    self.start = 0
-    self.pause = 0
-    self.hints = 0
-    self.active = False
-    self.second_iterator_thread = Thread(target=self.secondIterator, daemon=True)
-    self.file_watch_thread = Thread(target=self.fileWatch, daemon=True)
-  
-  # Reads time and hint values
-  def getValues(self):
-    # Make sure no other thread is interfering right now
-    self.lock.acquire()
-    start_f, pause_f, hints_f = None, None, None
-    # Try reading values from files
-    try:
-      start_f = open("start.txt","r")
-      pause_f = open("pause.txt","r")
-      hints_f = open("hints.txt","r")
-      self.start = int(start_f.read())
-      self.pause = int(pause_f.read())
-      self.hints = int(hints_f.read())
-      start_f.close()
-      pause_f.close()
-      hints_f.close()
-    # If there's an error, close any opened files and set negative values so that the user suspects that something went wrong
-    except:
-      if start_f!=None:
-        start_f.close()
-      if pause_f!=None:
-        pause_f.close()
-      if hints_f!=None:
-        hints_f.close()
-      self.start, self.pause = -1, -1
-    # Signal UI to update
-    self.update_ui_pointer(self.start, self.pause, self.hints, update_all=True)
-    # Determine if timer is running
-    self.active = not ((self.start==0 and self.pause==0) or (self.start==-1 or self.pause==-1))
-    # Allow other threads to do stuff now that we're done
-    self.lock.release()
-  
-  # Iterates time every second
-  def secondIterator(self):
-    while True:
-      sleep_time = 0.1
-      if self.active and self.lock.acquire(blocking=False):
-        #sleep_time = 0.1
-        self.update_ui_pointer(self.start, self.pause, self.hints)
-        # Calculate how much time is left until the next second (not needed anymore)
-        #sleep_time = 0.1-(time.time()-self.start/10)%0.1
-        self.lock.release()
-      # Sleep until the next second
-      time.sleep(sleep_time)
-  
-  # Periodically checks files for any changes made by external applications
-  def fileWatch(self):
-    while True:
-      self.getValues()
-      time.sleep(config['check-interval'])
-  
-  # Starts, pauses or resumes timer
-  def startPauseResume(self):
-    # Abort if time values are invalid
-    if self.start==-1 or self.pause==-1:
-      return;
-    # Make sure no other thread is interfering right now
-    self.lock.acquire()
-    
-    t = math.floor(time.time()*10)
-    
-    # Start
-    if self.start==0 and self.pause==0:
-      start_f = None
-      try:
-        start_f = open("start.txt","w")
-        start_f.write(str(t))
-        start_f.close()
-      except:
-        if start_f != None:
-          start_f.close()
-    
-    # Pause
-    elif self.pause==0:
-      pause_f = None
-      try:
-        pause_f = open("pause.txt","w")
-        pause_f.write(str(t))
-        pause_f.close()
-      except:
-        if pause_f != None:
-          pause_f.close()
-    
-    # Resume
-    else:
-      start_f = None
-      pause_f = None
-      
-      try:
-        # First get values from start and pause files, so we can do some calculations
-        start_f = open("start.txt","r")
-        pause_f = open("pause.txt","r")
-        start = int(start_f.read())
-        pause = int(pause_f.read())
-        start_f.close()
-        pause_f.close()
-        
-        # Find how long has the timer been paused for
-        diff = t-pause
-        # Move start time forward by that amount
-        start += diff
-        
-        # Write new values to files
-        start_f = open("start.txt","w")
-        pause_f = open("pause.txt","w")
-        start_f.write(str(start))
-        pause_f.write("0")
-        start_f.close()
-        pause_f.close()
-      except:
-        if start_f != None:
-          start_f.close()
-        if pause_f != None:
-          pause_f.close()
-    
-    # Allow other threads to do stuff now that we're done
-    self.lock.release()
-    # Trigger a file check, now that we made a change
-    self.getValues()
-  
-  # Resets timer
-  def reset(self):
-    # Get latest values
-    self.getValues()
-    # Create new file with a summary of this game
-    output_f = open(time.strftime("total_%Y%m%d_%H%M%S.txt"),"w")
-    # Calculate score and make time human readable
-    if self.pause==0:
-      t = math.floor(time.time()*10 - self.start)
-    else:
-      t = math.floor(self.pause - self.start)
-    hours = str(t//36000)
-    mins  = str((t//600)%60).zfill(2)
-    secs  = str(t/10).zfill(4)
-    if t==0 or self.hints<0:
-      score = "N/A"
-    else:
-      score = str(round(10000000/(t*((self.hints/4)+1)),3))
-    # Write summary to file
-    output_f.write(f"Time : {hours}:{mins}:{secs} ({str(t/10)}s)\n")
-    output_f.write(f"Hints: {str(self.hints)}\n")
-    output_f.write(f"Score: {score}\n")
-    output_f.close()
-    
-    # Make sure no other thread is interfering
-    self.lock.acquire()
-    # Open all files
-    start_f, pause_f, hints_f = None, None, None
-    try:
-      start_f = open("start.txt","w")
-      pause_f = open("pause.txt","w")
-      hints_f = open("hints.txt","w")
-      # Reset all values
-      start_f.write("0")
-      pause_f.write("0")
-      hints_f.write("0")
-      # Close files
-      start_f.close()
-      pause_f.close()
-      hints_f.close()
-    except:
-      if start_f != None:
-        start_f.close()
-      if pause_f != None:
-        pause_f.close()
-      if hints_f != None:
-        hints_f.close()
-    # Allow other threads to do stuff now that we're done
-    self.lock.release()
-    # Refresh values now that we changed them
-    self.getValues()
-  
-  # Adds hint
-  def hintAdd(self):
-    # Make sure no one else is interfering
-    self.lock.acquire()
-    
-    hints_f = None
-    try:
-      # Check how many hints we have
-      hints_f = open("hints.txt","r")
-      hints = int(hints_f.read())
-      hints_f.close()
-      
-      # Add one hint to that number
-      hints_f = open("hints.txt","w")
-      hints_f.write(str(hints+1))
-      hints_f.close()
-    except:
-      if hints_f != None:
-        hints_f.close()
-    
-    # Allow other threads to do stuff now that we're done
-    self.lock.release()
-    # Refresh values now that we changed them
-    self.getValues()
-  
-  # Removes hint
-  def hintRemove(self):
-    # Make sure no one else is interfering
-    self.lock.acquire()
-    
-    hints_f = None
-    try:
-      # Check how many hints we have
-      hints_f = open("hints.txt","r")
-      hints = int(hints_f.read())
-      hints_f.close()
-      
-      # Add one hint to that number
-      hints_f = open("hints.txt","w")
-      hints_f.write(str(hints-1))
-      hints_f.close()
-    except:
-      if hints_f != None:
-        hints_f.close()
-    
-    # Allow other threads to do stuff now that we're done
-    self.lock.release()
-    # Refresh values now that we changed them
-    self.getValues()
-  
-  # Halts execution when app is exiting
-  def halt(self):
-    self.lock.acquire()
+    self.engine.halt()
 
 
-# Class that handles communicating with the light control server
-class ledstripCommunicator():
-  def __init__(self):
-    self.lock = Lock()
-  
-  def __comms_thread(self,switch_to):
-    # Prevent multiple commands from being sent at the same time
-    self.lock.acquire()
-    try:
-      # Send request to the server
-      comms = HTTPConnection(config["address"], config["port"], timeout=20)
-      comms.request('GET',"/"+switch_to)
-      comms.getresponse()
-    except ConnectionRefusedError:
-      self.historyadd_pointer("<font color='red'>Couldn't connect to light control server:</font> Connection refused")
-    except OSError as e:
-      self.historyadd_pointer(f"<font color='red'>Couldn't connect to light control server:</font> {e}")
-    except TimeoutError:
-      self.historyadd_pointer("<font color='red'>Couldn't connect to light control server:</font> Timed out")
-    except BaseException as e:
-      self.historyadd_pointer("<font color='red'>Couldn't connect to light control server.</font>")
-      self.lock.release()
-      raise e
-    self.lock.release()
-  
-  def send(self,switch_to):
-    # Create thread that handles connection with server
-    Thread(target=self.__comms_thread, args=(switch_to,)).start()
+# Records how long startup took until the given step
+startup_steps = []
+def mark_startup(step):
+  startup_steps.append((time.perf_counter()-STARTUP_TIME, step))
 
+# Prints how long each step of startup took
+def print_startup_report():
+  mark_startup("event loop running")
+  print("\033[4mStartup time report:\033[0m")
+  for elapsed, step in startup_steps:
+    print(f"{elapsed*1000:8.1f} ms  {step}")
 
 # Main
 def main():
-  # Create objects
+  mark_startup("PySide2 imported")
   app = QApplication()
-  window = mainWindow()
-  time_watch = timeWatch()
-  ledstrip_comms = ledstripCommunicator()
+  mark_startup("QApplication created")
   
-  # Load config
-  if not load_config():
+  # Load config before building anything, so that a bad config is reported right away
+  error = game_core.load_config()
+  if error!=None:
     # If we can't load the config file, show an error message and quit.
     title = "Escape Room - Creator Panel"
-    message = f"""Could not load configuration file; it might be missing, invalid or incomplete. 
+    required, optional = CONFIG_SCHEMA.help()
+    required = "".join(f"<b>{key}=</b><i><font color='gray'>{description}</font></i><br/>" for key, description in required)
+    optional = "<br/>".join(f"<b>{key}=</b><i><font color='gray'>{description}</font></i>" for key, description in optional)
+    message = f"""Could not load configuration file: <b>{html.escape(error)}</b><br/><br/>
 Configuration file should be named '{CONFIG_PATH}', located in the directory where the app is run, and needs to have this format and values:<br/><br/>
-<b>check-interval=</b><i><font color='gray'>Integer in seconds that indicates how often to check for timer/hint changes by external applications</font></i><br/>
-<b>address=</b><i><font color='gray'>Address of computer where the light control server is running</font></i><br/>
-<b>port=</b><i><font color='gray'>Port that the light control server is listening to</font></i>"""
+{required}<br/>
+Optional values:<br/>
+{optional}"""
     msgbox = QMessageBox(QMessageBox.Critical, title, message)
     msgbox.setTextFormat(Qt.RichText)
     msgbox.exec()
     sys.exit()
+  mark_startup("configuration loaded")
+  
+  # Create objects
+  engine = gameEngine()
+  window = mainWindow(engine)
+  mark_startup("main window created")
   
-  # Connect class functions
-  time_watch.update_ui_pointer = window.updateUi
-  window.start_pointer = time_watch.startPauseResume
-  window.reset_pointer = time_watch.reset
-  window.hintadd_pointer = time_watch.hintAdd
-  window.hintremove_pointer = time_watch.hintRemove
-  window.ledstrip_send_pointer = ledstrip_comms.send
-  window.timewatch_halt_pointer = time_watch.halt
-  ledstrip_comms.historyadd_pointer = window.historyAdd
+  # Start the game, recovering it from the journal in case we crashed
+  try:
+    engine.start()
+  except engineBusy as e:
+    msgbox = QMessageBox(QMessageBox.Critical, "Escape Room - Creator Panel", str(e))
+    msgbox.exec()
+    sys.exit()
+  mark_startup(f"game engine started ({len(engine.historyLines())} history entries)")
   
   # Start things
-  time_watch.file_watch_thread.start()
-  time_watch.second_iterator_thread.start()
   window.show()
+  # Report startup times once the window is up and the event loop is running
+  QTimer.singleShot(0, print_startup_report)
   sys.exit(app.exec_());
 
 # Redirects to main
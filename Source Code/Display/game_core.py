@@ -0,0 +1,1028 @@
+#!/bin/python3
+# Game logic of the creator panel: timer, hints, scoring, lights, journal and display state server.
+# It doesn't depend on Qt, so it can run on its own as a lightweight daemon, with front-ends (the Qt creator panel,
+# a web panel or the command line) attached to it through the game engine's events.
+import os, sys, math, json, time
+from threading import Thread, Lock
+from queue import Queue
+from http import HTTPStatus
+from urllib.parse import urlparse, parse_qs
+from http.client import HTTPConnection
+try:
+  import fcntl
+except ImportError:
+  # Only available on Unix; elsewhere, nothing stops two engines from sharing a directory
+  fcntl = None
+from config_schema import schema, setting, configError, integer, port
+
+CONFIG_PATH = "creator_panel.conf"
+# Seconds the journal waits for more events before writing a batch to disk
+JOURNAL_BATCH_DELAY = 0.05
+# Number of events between snapshots in the journal's index, used by session_replay.py to seek quickly
+JOURNAL_SNAPSHOT_EVERY = 50
+# Queued in place of an event to end the current game's journal
+ROTATE = object()
+# Longest time a display can wait for a state change in one request, in seconds
+HUB_MAX_WAIT = 60
+# Seconds a client gets to send its request, and to accept data we send it before it's dropped
+HUB_REQUEST_TIMEOUT = 10
+HUB_WRITE_TIMEOUT = 10
+# Seconds between keepalive messages on event streams
+HUB_KEEPALIVE = 15
+# Seconds between timer updates sent to front-ends while the timer is running
+TICK_INTERVAL = 0.1
+# Seconds between checks of the light control server's health, and how long it gets to answer
+HEALTH_POLL = 5
+HEALTH_TIMEOUT = 5
+# Slideshows that can be sent to the light control server
+SLIDESHOWS = {"8.1": "Item 8 Hint 1", "8.2": "Item 8 Hint 2"}
+# Settings of the config file
+CONFIG_SCHEMA = schema("panelConfig", [
+  setting("check-interval", integer(1), description="Integer in seconds that indicates how often to check for timer/hint changes by external applications"),
+  setting("address", description="Address of computer where the light control server is running"),
+  setting("port", port, description="Port that the light control server is listening to"),
+  setting("state-port", port, None, "Port for serving the timer state to displays at '/state' and '/events'. Disabled if not set"),
+  setting("state-hostname", default="", description="Address the state server listens on. Defaults to all addresses"),
+  setting("journal", default="journal.log", description="File where the current game is journaled, so it can be recovered after a crash. Defaults to 'journal.log'"),
+])
+config = None
+
+
+# Load configuration file, from the given path or the directory where the app is run.
+# Returns None if successful, or a message that says what's wrong.
+def load_config(path=CONFIG_PATH):
+  global config
+  try:
+    config = CONFIG_SCHEMA.load(path)
+  except configError as e:
+    return str(e)
+  return None
+
+
+# Calculates game time in deciseconds from the timer's state
+def game_time(start, pause, now=None):
+  # Timer hasn't started, or its state is invalid
+  if start<=0:
+    return 0
+  # Timer is started but not paused
+  if pause==0:
+    return math.floor((time.time() if now==None else now)*10) - start
+  # Timer is paused
+  return pause - start
+
+# Makes game time human readable
+def time_string(t):
+  hours = str(t//36000)
+  mins  = str((t//600)%60).zfill(2)
+  secs  = str((t//10)%60).zfill(2)
+  return f"{hours}:{mins}:{secs}"
+
+# Calculates score from game time and hints
+def score(t, hints):
+  if t<=0 or hints<0:
+    return "N/A"
+  return str(round(10000000/(t*((hints/4)+1)),3))
+
+
+# Events sent by the game engine to its front-ends.
+# Front-ends subscribe to the classes of events they're interested in, and get them from the engine's threads.
+
+# Sent whenever the timer's state is read from its files
+class stateEvent():
+  def __init__(self, start, pause, hints):
+    self.start = start
+    self.pause = pause
+    self.hints = hints
+    self.time = game_time(start, pause)
+    self.time_str = time_string(self.time)
+    self.score = score(self.time, hints)
+    self.valid = start!=-1 and pause!=-1
+    self.running = self.valid and start!=0 and pause==0
+
+# Sent periodically while the timer is running, so that front-ends can show the time going forward
+class tickEvent(stateEvent):
+  pass
+
+# Sent when an action is added to the history. 'restored' is set for entries recovered from the journal.
+class historyEvent():
+  def __init__(self, html, restored=False):
+    self.html = html
+    self.restored = restored
+
+# Sent when the health of the light control server changes. 'detail' tells what isn't working.
+class healthEvent():
+  def __init__(self, ok, detail):
+    self.ok = ok
+    self.detail = detail
+
+
+# Sums up a health report of the light control server, as a tuple of (ok, detail)
+def health_summary(report):
+  failed = [f"{name}: {result['detail']}" for name, result in report["checks"].items() if not result["ok"]]
+  if len(failed)==0:
+    return True, "OK"
+  return False, "; ".join(failed)
+
+
+# Class that runs a game and lets front-ends control it and follow it
+# Raised when another game engine (the creator panel, the light control server's operator panel, or the command line)
+# is already running in the same directory, since they would both write to the same journal and state files
+class engineBusy(Exception):
+  pass
+
+
+class gameEngine():
+  # The game's files (state, summaries and journal) are kept in 'directory'
+  def __init__(self, game_config=None, light_sender=None, directory="."):
+    self.config = config if game_config==None else game_config
+    self.directory = directory
+    self.lock = Lock()
+    self.subscribers = dict()
+    self.history = []
+    self.time_str = time_string(0)
+    self.time_watch = timeWatch(self)
+    self.journal = gameJournal(os.path.join(directory, self.config.journal))
+    # Held while the engine runs, so that only one engine uses the directory
+    self.lock_path = os.path.join(directory, self.config.journal+".lock")
+    self.lock_f = None
+    # Lights are sent to the light control server, unless something else is given that has a 'send(command)' method
+    if light_sender==None:
+      light_sender = ledstripCommunicator(self.config.address, self.config.port, self.lightError)
+    self.light_sender = light_sender
+    # Latest health of the lights, if the light sender can check it
+    self.health = None
+    self.hub = None
+    if self.config.state_port!=None:
+      self.hub = broadcastHub(self.config.state_hostname, self.config.state_port)
+  
+  # Calls 'callback' with every event of the given class
+  def subscribe(self, event_class, callback):
+    self.lock.acquire()
+    self.subscribers.setdefault(event_class, []).append(callback)
+    self.lock.release()
+  
+  def unsubscribe(self, event_class, callback):
+    self.lock.acquire()
+    if callback in self.subscribers.get(event_class, []):
+      self.subscribers[event_class].remove(callback)
+    self.lock.release()
+  
+  def emit(self, event):
+    self.lock.acquire()
+    callbacks = list(self.subscribers.get(type(event), []))
+    self.lock.release()
+    for callback in callbacks:
+      callback(event)
+  
+  # Recovers the current game from the journal in case we crashed, and starts running.
+  # Returns True if the timer was restored from the journal. Raises engineBusy if another engine uses the directory.
+  def start(self):
+    self.__acquire()
+    if self.hub!=None:
+      self.hub.start()
+    history, state = self.journal.replay()
+    self.lock.acquire()
+    self.history += history
+    self.lock.release()
+    for line in history:
+      self.emit(historyEvent(line, restored=True))
+    self.journal.start()
+    restored = state!=None and self.time_watch.restore(*state)
+    if restored:
+      self.historyAdd("<font color='orange'>Restored <b>timer</b> from journal.</font>")
+    self.time_watch.file_watch_thread.start()
+    self.time_watch.second_iterator_thread.start()
+    if hasattr(self.light_sender, "health"):
+      Thread(target=self.__healthThread, daemon=True).start()
+    return restored
+  
+  # Takes the directory's lock. It's released by the OS when the process exits, even if it crashes.
+  def __acquire(self):
+    if fcntl == None:
+      return
+    self.lock_f = open(self.lock_path, "a")
+    try:
+      fcntl.flock(self.lock_f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+      self.lock_f.close()
+      self.lock_f = None
+      raise engineBusy(f"Another game engine is already running in '{os.path.abspath(self.directory)}' (lock '{self.lock_path}' is held)")
+  
+  # Checks the health of the lights periodically, and lets front-ends know when it changes
+  def __healthThread(self):
+    while True:
+      ok, detail = self.light_sender.health()
+      if self.health==None or (self.health.ok, self.health.detail)!=(ok, detail):
+        self.health = healthEvent(ok, detail)
+        self.emit(self.health)
+      time.sleep(HEALTH_POLL)
+  
+  # Stops changes to the timer and makes sure the journal is written, when the app is exiting
+  def halt(self):
+    self.time_watch.halt()
+    self.journal.flush()
+  
+  # Sends the timer's state to front-ends right away, instead of waiting for the next check
+  def refresh(self):
+    self.time_watch.getValues()
+  
+  # Returns a copy of the history, for front-ends that attach after the game started
+  def historyLines(self):
+    self.lock.acquire()
+    history = list(self.history)
+    self.lock.release()
+    return history
+  
+  # Adds action to history
+  def historyAdd(self, text):
+    self.lock.acquire()
+    timestamp = time.strftime(f"<i><font color='gray'>%H:%M sys, </font></i><font color='#007FFF'>{self.time_str} game</font> ")
+    self.history.append(timestamp+text)
+    self.lock.release()
+    self.journal.record("history", html=timestamp+text)
+    self.emit(historyEvent(timestamp+text))
+  
+  def sendLights(self, command):
+    self.journal.record("light", command=command)
+    self.light_sender.send(command)
+  
+  # Reports a light command that couldn't be sent, with the reason if it's known
+  def lightError(self, reason):
+    if reason==None:
+      self.historyAdd("<font color='red'>Couldn't connect to light control server.</font>")
+    else:
+      self.historyAdd(f"<font color='red'>Couldn't connect to light control server:</font> {reason}")
+  
+  # Called by the time watch whenever it reads the timer's state
+  def stateRead(self, start, pause, hints, changed):
+    event = stateEvent(start, pause, hints)
+    self.lock.acquire()
+    self.time_str = event.time_str
+    self.lock.release()
+    if self.hub!=None:
+      self.hub.publish(start, pause, hints)
+    # Journal the state whenever it changes, no matter who changed it
+    if changed:
+      self.journal.record("state", start=start, pause=pause, hints=hints)
+    self.emit(event)
+  
+  # Called by the time watch while the timer is running
+  def tick(self, start, pause, hints):
+    event = tickEvent(start, pause, hints)
+    self.lock.acquire()
+    self.time_str = event.time_str
+    self.lock.release()
+    self.emit(event)
+  
+  # Called by the time watch when a game ends, before the timer is reset
+  def gameOver(self, t, hints, score):
+    self.journal.record("reset", time=t, hints=hints, score=score)
+    self.journal.rotate()
+  
+  # Actions front-ends can take
+  def toggleTimer(self):
+    self.historyAdd("Toggled <b>timer</b>.")
+    self.time_watch.startPauseResume()
+    self.sendLights("base")
+  
+  def reset(self):
+    self.historyAdd("<b>Reset</b>.")
+    self.time_watch.reset()
+    self.sendLights("base")
+  
+  def addHint(self):
+    self.historyAdd("Added <b>hint</b>.")
+    self.time_watch.hintAdd()
+    self.sendLights("hint")
+  
+  def removeHint(self):
+    self.historyAdd("Removed <b>hint</b>.")
+    self.time_watch.hintRemove()
+  
+  def victoryLights(self):
+    self.historyAdd("Set victory <b>lights</b>.")
+    self.sendLights("victory")
+  
+  def resetLights(self):
+    self.historyAdd("Reset <b>lights</b>.")
+    self.sendLights("base")
+  
+  def blankScreen(self):
+    self.historyAdd("Blanked <b>screen</b>.")
+    self.sendLights("blank")
+  
+  def sendSlideshow(self, name):
+    self.historyAdd(f"Sent <b>slideshow</b> {name}.")
+    self.sendLights(f"show-{name}")
+  
+  def pressSpace(self):
+    self.sendLights("space")
+
+
+# Class that handles reading and modifying files which hold time/hint data
+class timeWatch():
+  def __init__(self, engine):
+    self.engine = engine
+    self.lock = Lock()
+    self.start = 0
+    self.pause = 0
+    self.hints = 0
+    self.recorded_state = None
+    self.active = False
+    self.second_iterator_thread = Thread(target=self.secondIterator, daemon=True)
+    self.file_watch_thread = Thread(target=self.fileWatch, daemon=True)
+  
+  # Path of one of the game's files
+  def file(self, name):
+    return os.path.join(self.engine.directory, name)
+  
+  # Reads time and hint values
+  def getValues(self):
+    # Make sure no other thread is interfering right now
+    self.lock.acquire()
+    start_f, pause_f, hints_f = None, None, None
+    # Try reading values from files
+    try:
+      start_f = open(self.file("start.txt"),"r")
+      pause_f = open(self.file("pause.txt"),"r")
+      hints_f = open(self.file("hints.txt"),"r")
+      self.start = int(start_f.read())
+      self.pause = int(pause_f.read())
+      self.hints = int(hints_f.read())
+      start_f.close()
+      pause_f.close()
+      hints_f.close()
+    # If there's an error, close any opened files and set negative values so that the user suspects that something went wrong
+    except:
+      if start_f!=None:
+        start_f.close()
+      if pause_f!=None:
+        pause_f.close()
+      if hints_f!=None:
+        hints_f.close()
+      self.start, self.pause = -1, -1
+    changed = self.recorded_state != (self.start, self.pause, self.hints)
+    self.recorded_state = (self.start, self.pause, self.hints)
+    # Signal front-ends and displays to update
+    self.engine.stateRead(self.start, self.pause, self.hints, changed)
+    # Determine if timer is running
+    self.active = not ((self.start==0 and self.pause==0) or (self.start==-1 or self.pause==-1))
+    # Allow other threads to do stuff now that we're done
+    self.lock.release()
+  
+  # Iterates time every second
+  def secondIterator(self):
+    while True:
+      sleep_time = TICK_INTERVAL
+      if self.active and self.lock.acquire(blocking=False):
+        self.engine.tick(self.start, self.pause, self.hints)
+        self.lock.release()
+      # Sleep until the next second
+      time.sleep(sleep_time)
+  
+  # Periodically checks files for any changes made by external applications
+  def fileWatch(self):
+    while True:
+      self.getValues()
+      time.sleep(self.engine.config.check_interval)
+  
+  # Starts, pauses or resumes timer
+  def startPauseResume(self):
+    # Abort if time values are invalid
+    if self.start==-1 or self.pause==-1:
+      return;
+    # Make sure no other thread is interfering right now
+    self.lock.acquire()
+    
+    t = math.floor(time.time()*10)
+    
+    # Start
+    if self.start==0 and self.pause==0:
+      start_f = None
+      try:
+        start_f = open(self.file("start.txt"),"w")
+        start_f.write(str(t))
+        start_f.close()
+      except:
+        if start_f != None:
+          start_f.close()
+    
+    # Pause
+    elif self.pause==0:
+      pause_f = None
+      try:
+        pause_f = open(self.file("pause.txt"),"w")
+        pause_f.write(str(t))
+        pause_f.close()
+      except:
+        if pause_f != None:
+          pause_f.close()
+    
+    # Resume
+    else:
+      start_f = None
+      pause_f = None
+      
+      try:
+        # First get values from start and pause files, so we can do some calculations
+        start_f = open(self.file("start.txt"),"r")
+        pause_f = open(self.file("pause.txt"),"r")
+        start = int(start_f.read())
+        pause = int(pause_f.read())
+        start_f.close()
+        pause_f.close()
+        
+        # Find how long has the timer been paused for
+        diff = t-pause
+        # Move start time forward by that amount
+        start += diff
+        
+        # Write new values to files
+        start_f = open(self.file("start.txt"),"w")
+        pause_f = open(self.file("pause.txt"),"w")
+        start_f.write(str(start))
+        pause_f.write("0")
+        start_f.close()
+        pause_f.close()
+      except:
+        if start_f != None:
+          start_f.close()
+        if pause_f != None:
+          pause_f.close()
+    
+    # Allow other threads to do stuff now that we're done
+    self.lock.release()
+    # Trigger a file check, now that we made a change
+    self.getValues()
+  
+  # Resets timer
+  def reset(self):
+    # Get latest values
+    self.getValues()
+    # Create new file with a summary of this game
+    output_f = open(self.file(time.strftime("total_%Y%m%d_%H%M%S.txt")),"w")
+    # Calculate score and make time human readable
+    if self.pause==0:
+      t = math.floor(time.time()*10 - self.start)
+    else:
+      t = math.floor(self.pause - self.start)
+    hours = str(t//36000)
+    mins  = str((t//600)%60).zfill(2)
+    secs  = str(t/10).zfill(4)
+    game_score = score(t, self.hints)
+    # Write summary to file
+    output_f.write(f"Time : {hours}:{mins}:{secs} ({str(t/10)}s)\n")
+    output_f.write(f"Hints: {str(self.hints)}\n")
+    output_f.write(f"Score: {game_score}\n")
+    output_f.close()
+    self.engine.gameOver(t, self.hints, game_score)
+    
+    # Make sure no other thread is interfering
+    self.lock.acquire()
+    # Open all files
+    start_f, pause_f, hints_f = None, None, None
+    try:
+      start_f = open(self.file("start.txt"),"w")
+      pause_f = open(self.file("pause.txt"),"w")
+      hints_f = open(self.file("hints.txt"),"w")
+      # Reset all values
+      start_f.write("0")
+      pause_f.write("0")
+      hints_f.write("0")
+      # Close files
+      start_f.close()
+      pause_f.close()
+      hints_f.close()
+    except:
+      if start_f != None:
+        start_f.close()
+      if pause_f != None:
+        pause_f.close()
+      if hints_f != None:
+        hints_f.close()
+    # Allow other threads to do stuff now that we're done
+    self.lock.release()
+    # Refresh values now that we changed them
+    self.getValues()
+  
+  # Adds hint
+  def hintAdd(self):
+    # Make sure no one else is interfering
+    self.lock.acquire()
+    
+    hints_f = None
+    try:
+      # Check how many hints we have
+      hints_f = open(self.file("hints.txt"),"r")
+      hints = int(hints_f.read())
+      hints_f.close()
+      
+      # Add one hint to that number
+      hints_f = open(self.file("hints.txt"),"w")
+      hints_f.write(str(hints+1))
+      hints_f.close()
+    except:
+      if hints_f != None:
+        hints_f.close()
+    
+    # Allow other threads to do stuff now that we're done
+    self.lock.release()
+    # Refresh values now that we changed them
+    self.getValues()
+  
+  # Removes hint
+  def hintRemove(self):
+    # Make sure no one else is interfering
+    self.lock.acquire()
+    
+    hints_f = None
+    try:
+      # Check how many hints we have
+      hints_f = open(self.file("hints.txt"),"r")
+      hints = int(hints_f.read())
+      hints_f.close()
+      
+      # Add one hint to that number
+      hints_f = open(self.file("hints.txt"),"w")
+      hints_f.write(str(hints-1))
+      hints_f.close()
+    except:
+      if hints_f != None:
+        hints_f.close()
+    
+    # Allow other threads to do stuff now that we're done
+    self.lock.release()
+    # Refresh values now that we changed them
+    self.getValues()
+  
+  # Writes time and hint values recovered from the journal, if the files don't hold valid ones
+  def restore(self, start, pause, hints):
+    self.getValues()
+    if self.start!=-1 and self.pause!=-1:
+      return False
+    self.lock.acquire()
+    try:
+      for name, value in (("start.txt", start), ("pause.txt", pause), ("hints.txt", hints)):
+        with open(self.file(name), "w") as value_f:
+          value_f.write(str(value))
+    except OSError:
+      pass
+    self.lock.release()
+    self.getValues()
+    return True
+  
+  # Halts execution when app is exiting
+  def halt(self):
+    self.lock.acquire()
+
+
+# Class that handles communicating with the light control server
+class ledstripCommunicator():
+  def __init__(self, address, port, report_error):
+    self.lock = Lock()
+    self.address = address
+    self.port = port
+    self.report_error = report_error
+  
+  def __comms_thread(self,switch_to):
+    # Prevent multiple commands from being sent at the same time
+    self.lock.acquire()
+    try:
+      # Send request to the server
+      comms = HTTPConnection(self.address, self.port, timeout=20)
+      comms.request('GET',"/"+switch_to)
+      comms.getresponse()
+    except ConnectionRefusedError:
+      self.report_error("Connection refused")
+    except OSError as e:
+      self.report_error(str(e))
+    except TimeoutError:
+      self.report_error("Timed out")
+    except BaseException as e:
+      self.report_error(None)
+      self.lock.release()
+      raise e
+    self.lock.release()
+  
+  def send(self,switch_to):
+    # Create thread that handles connection with server
+    Thread(target=self.__comms_thread, args=(switch_to,)).start()
+  
+  # Asks the server for its health report
+  def health(self):
+    try:
+      comms = HTTPConnection(self.address, self.port, timeout=HEALTH_TIMEOUT)
+      comms.request('GET', "/health")
+      report = json.loads(comms.getresponse().read())
+      comms.close()
+    except (OSError, ValueError) as e:
+      return False, f"Light control server unreachable: {e}"
+    return health_summary(report)
+
+
+# Class that keeps an append-only journal of everything that happens during a game, so that a crash doesn't lose it.
+# Events are written by a background thread in batches, with one fsync per batch, so that callers never wait for the disk.
+# The journal holds the current game only; on reset it's moved to a 'session_*.log' file and a new one is started.
+class gameJournal():
+  def __init__(self, path):
+    self.path = path
+    self.queue = Queue()
+    self.journal_f = None
+    self.index_f = None
+    # What a replay needs to know to start from the current position, written to the index every few events
+    self.snapshot = {"events": 0, "state": None, "light": None, "history": 0}
+    self.thread = Thread(target=self.__writerThread, daemon=True)
+  
+  def start(self):
+    self.__open()
+    self.thread.start()
+  
+  # Queues an event. Can be called from any thread.
+  def record(self, event_type, **data):
+    data["t"] = round(time.time(), 3)
+    data["type"] = event_type
+    self.queue.put((data, json.dumps(data, separators=(',', ':'))))
+  
+  # Ends the current game's journal once everything before this call is written
+  def rotate(self):
+    self.queue.put(ROTATE)
+  
+  # Waits until all queued events are on disk
+  def flush(self):
+    self.queue.join()
+  
+  # Reads back the current game's journal. Returns the history lines and the last known (start, pause, hints) state.
+  def replay(self):
+    history = []
+    if not os.path.exists(self.path):
+      return history, None
+    with open(self.path, "r") as journal_f:
+      for line in journal_f:
+        try:
+          event = json.loads(line)
+        except ValueError:
+          # The last line might be incomplete if we crashed while writing it
+          continue
+        self.__track(event)
+        if event["type"] == "history":
+          history.append(event["html"])
+    return history, self.snapshot["state"]
+  
+  # Keeps the snapshot up to date with an event
+  def __track(self, event):
+    self.snapshot["events"] += 1
+    if event["type"] == "state":
+      self.snapshot["state"] = (event["start"], event["pause"], event["hints"])
+    elif event["type"] == "light":
+      self.snapshot["light"] = event["command"]
+    elif event["type"] == "history":
+      self.snapshot["history"] += 1
+  
+  def __open(self):
+    self.journal_f = self.__append(self.path)
+    self.index_f = self.__append(self.path+".idx")
+  
+  # Opens a file for appending. If a crash left its last line incomplete, that line is ended first,
+  # so that the next event isn't glued onto it and lost along with it.
+  def __append(self, path):
+    append_f = open(path, "ab")
+    if append_f.tell() > 0:
+      with open(path, "rb") as check_f:
+        check_f.seek(-1, os.SEEK_END)
+        if check_f.read(1) != b"\n":
+          append_f.write(b"\n")
+    return append_f
+  
+  def __writerThread(self):
+    while True:
+      batch = [self.queue.get()]
+      # Give other events a moment to arrive, so they share one fsync
+      time.sleep(JOURNAL_BATCH_DELAY)
+      while not self.queue.empty():
+        batch.append(self.queue.get())
+      try:
+        for item in batch:
+          if item is ROTATE:
+            # The game goes on in the same journal if it can't be moved away, instead of losing the events after it
+            try:
+              self.__rotate()
+            except OSError as e:
+              print(f"Could not end the journal of the last game: {e}")
+            continue
+          data, line = item
+          self.journal_f.write(line.encode()+b"\n")
+          self.__track(data)
+          # Every few events, note where replays can start from without reading everything before
+          if self.snapshot["events"] % JOURNAL_SNAPSHOT_EVERY == 0:
+            entry = dict(self.snapshot, t=data["t"], offset=self.journal_f.tell())
+            self.index_f.write(json.dumps(entry, separators=(',', ':')).encode()+b"\n")
+        for journal_f in (self.journal_f, self.index_f):
+          journal_f.flush()
+          os.fsync(journal_f.fileno())
+      except (OSError, ValueError) as e:
+        print(f"Could not write to journal: {e}")
+      finally:
+        # flush() waits for every event to be marked done, so this must happen even if writing failed
+        for item in batch:
+          self.queue.task_done()
+  
+  def __rotate(self):
+    try:
+      for journal_f in (self.journal_f, self.index_f):
+        journal_f.flush()
+        os.fsync(journal_f.fileno())
+        journal_f.close()
+      # Don't overwrite another session that ended in the same second
+      name = os.path.join(os.path.dirname(self.path), time.strftime("session_%Y%m%d_%H%M%S"))
+      suffix = ""
+      while os.path.exists(name+suffix+".log"):
+        suffix = f"_{len(suffix)+1}" if suffix=="" else f"_{int(suffix[1:])+1}"
+      os.replace(self.path, name+suffix+".log")
+      self.snapshot = {"events": 0, "state": None, "light": None, "history": 0}
+      os.replace(self.path+".idx", name+suffix+".log.idx")
+    finally:
+      # Reopen the files even if the session couldn't be moved away, so that later events aren't written to closed files
+      for journal_f in (self.journal_f, self.index_f):
+        try:
+          journal_f.close()
+        except OSError:
+          pass
+      self.__open()
+
+
+# Class that broadcasts the timer state to displays and spectator screens, so they don't have to read the state files.
+# All clients are served from a single asyncio event loop, and every state change is serialized only once.
+# Clients can either:
+# - subscribe to '/events', a server-sent event stream that gets every change, or
+# - poll '/state', optionally waiting for the next change with '?since=<version>&wait=<seconds>'
+#   (or an If-None-Match header), getting a 304 response if nothing changed in that time.
+# Every change gets a new version number, which is also used as the ETag and the event ID.
+class broadcastHub():
+  def __init__(self, hostname, port):
+    # asyncio is only imported if the hub is used, and kept with the hub that uses it
+    import asyncio
+    self.asyncio = asyncio
+    self.loop = self.asyncio.new_event_loop()
+    self.hostname = hostname
+    self.port = port
+    # Start counting from the current time, so that versions keep increasing across restarts
+    self.version = int(time.time()*1000)
+    self.state = None
+    self.body = b""
+    self.event = b""
+    self.changed = None
+    self.subscribers = set()
+    self.running = False
+  
+  def start(self):
+    self.running = True
+    Thread(target=self.__loopThread, daemon=True).start()
+  
+  # Stores new state values. Can be called from any thread.
+  def publish(self, start, pause, hints):
+    if self.running:
+      self.loop.call_soon_threadsafe(self.__publish, (start, pause, hints))
+  
+  def __loopThread(self):
+    self.asyncio.set_event_loop(self.loop)
+    self.changed = self.asyncio.Event()
+    server = self.loop.run_until_complete(self.asyncio.start_server(self.__handle, self.hostname, self.port, backlog=512))
+    self.loop.run_until_complete(server.serve_forever())
+  
+  def __publish(self, state):
+    if state == self.state:
+      return
+    self.state = state
+    self.version += 1
+    start, pause, hints = state
+    # Serialize once here, instead of once per client
+    self.body = json.dumps({"version": self.version, "start": start, "stop": 0, "hints": hints, "pause": pause}).encode()
+    self.event = b"id: %d\nevent: state\ndata: %s\n\n" % (self.version, self.body)
+    # Hand the event to every subscriber. Each event holds the whole state, so a subscriber
+    # that hasn't sent the previous one yet only needs the latest.
+    for subscriber in self.subscribers:
+      subscriber.pending = self.event
+      subscriber.wake.set()
+    # Wake up waiting pollers
+    if self.changed != None:
+      self.changed.set()
+      self.changed = self.asyncio.Event()
+  
+  # Reads a request and dispatches it. Connections are closed after one request.
+  async def __handle(self, reader, writer):
+    try:
+      head = await self.asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), HUB_REQUEST_TIMEOUT)
+      lines = head.decode("latin-1").split("\r\n")
+      method, target, _ = lines[0].split(' ', 2)
+      headers = dict()
+      for line in lines[1:]:
+        key, _, value = line.partition(':')
+        headers[key.strip().lower()] = value.strip()
+      url = urlparse(target)
+      query = parse_qs(url.query)
+      if method != "GET":
+        await self.__respond(writer, 405)
+      elif url.path == "/state":
+        await self.__state(writer, query, headers)
+      elif url.path == "/events":
+        await self.__events(writer, query, headers)
+      else:
+        await self.__respond(writer, 404)
+    except (self.asyncio.TimeoutError, self.asyncio.IncompleteReadError, self.asyncio.LimitOverrunError, ConnectionError, ValueError):
+      pass
+    finally:
+      writer.close()
+  
+  async def __respond(self, writer, status, headers=(), body=b""):
+    lines = [f"HTTP/1.1 {status} {HTTPStatus(status).phrase}", "Connection: close", "Cache-Control: no-cache",
+             "Access-Control-Allow-Origin: *", "Access-Control-Expose-Headers: ETag"]
+    lines += headers
+    if status != 304:
+      lines.append(f"Content-Length: {len(body)}")
+    writer.write(("\r\n".join(lines)+"\r\n\r\n").encode() + body)
+    await self.asyncio.wait_for(writer.drain(), HUB_WRITE_TIMEOUT)
+  
+  async def __state(self, writer, query, headers):
+    known_version = client_version(query.get("since", [headers.get("if-none-match", "")])[0])
+    try:
+      wait = min(max(float(query.get("wait", ["0"])[0]), 0), HUB_MAX_WAIT)
+    except ValueError:
+      wait = 0
+    # Hold the request until the state changes, if the client already has the current version,
+    # or until there's a state at all, if the game engine hasn't read it yet
+    if (known_version == self.version or self.state == None) and wait > 0:
+      try:
+        await self.asyncio.wait_for(self.changed.wait(), wait)
+      except self.asyncio.TimeoutError:
+        pass
+    etag = f'ETag: "{self.version}"'
+    if self.state == None:
+      await self.__respond(writer, 503, ["Retry-After: 1"])
+    elif known_version == self.version:
+      await self.__respond(writer, 304, [etag])
+    else:
+      await self.__respond(writer, 200, [etag, "Content-Type: application/json"], self.body)
+  
+  async def __events(self, writer, query, headers):
+    writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: text/event-stream\r\nCache-Control: no-cache\r\nConnection: close\r\nAccess-Control-Allow-Origin: *\r\n\r\n")
+    subscriber = hubSubscriber(self.asyncio.Event())
+    # Send the current state right away, unless the client already has it
+    known_version = client_version(query.get("since", [headers.get("last-event-id", "")])[0])
+    if known_version != self.version and self.state != None:
+      subscriber.pending = self.event
+      subscriber.wake.set()
+    self.subscribers.add(subscriber)
+    try:
+      while True:
+        try:
+          await self.asyncio.wait_for(subscriber.wake.wait(), HUB_KEEPALIVE)
+          subscriber.wake.clear()
+          message, subscriber.pending = subscriber.pending, None
+        except self.asyncio.TimeoutError:
+          # Comments keep proxies from closing the stream, and reveal clients that went away
+          message = b": keepalive\n\n"
+        writer.write(message)
+        # A client that can't keep up is dropped, instead of letting its data pile up
+        await self.asyncio.wait_for(writer.drain(), HUB_WRITE_TIMEOUT)
+    finally:
+      self.subscribers.discard(subscriber)
+
+
+# Event stream client of the broadcast hub, holding the latest event that wasn't sent to it yet
+class hubSubscriber():
+  def __init__(self, wake):
+    self.pending = None
+    self.wake = wake
+
+
+# Parses a version number sent by a client as a query value or header, which may be quoted like an ETag
+def client_version(value):
+  try:
+    return int(value.strip('" '))
+  except ValueError:
+    return None
+
+
+# Command line front-end. Prints the history as it happens and reads actions from standard input.
+class commandLine():
+  def __init__(self, engine):
+    self.engine = engine
+    self.commands = {
+      "start":    (engine.toggleTimer,   "Starts, pauses or resumes the timer"),
+      "reset":    (engine.reset,         "Ends the game and resets the timer"),
+      "hint+":    (engine.addHint,       "Adds a hint"),
+      "hint-":    (engine.removeHint,    "Removes a hint"),
+      "victory":  (engine.victoryLights, "Sets victory lights"),
+      "lights":   (engine.resetLights,   "Resets lights"),
+      "blank":    (engine.blankScreen,   "Blanks the screen"),
+      "space":    (engine.pressSpace,    "Presses space on the slideshow"),
+      "status":   (self.status,          "Shows time, hints and score"),
+    }
+    self.state = stateEvent(0, 0, 0)
+    engine.subscribe(historyEvent, self.historyAdded)
+    engine.subscribe(stateEvent, self.stateChanged)
+    engine.subscribe(healthEvent, self.healthChanged)
+  
+  def historyAdded(self, event):
+    print(strip_html(event.html))
+  
+  def stateChanged(self, event):
+    self.state = event
+  
+  def healthChanged(self, event):
+    print(f"Lights: {event.detail}")
+  
+  def status(self):
+    # Time is calculated again, since state events are only sent when the files are checked
+    state = stateEvent(self.state.start, self.state.pause, self.state.hints)
+    print(f"Time: {state.time_str} ({state.time/10}s), Hints: {state.hints}, Score: {state.score}")
+    if self.engine.health!=None:
+      print(f"Lights: {self.engine.health.detail}")
+  
+  def help(self):
+    for name, (action, description) in self.commands.items():
+      print(f"  {name:<10}{description}")
+    for name, description in SLIDESHOWS.items():
+      print(f"  {'show '+name:<10}Sends slideshow '{description}'")
+    print(f"  {'quit':<10}Exits")
+  
+  # Reads commands until the end of input
+  def run(self):
+    print("Type 'help' for a list of commands.")
+    for line in sys.stdin:
+      words = line.split()
+      if len(words)==0:
+        continue
+      if words[0]=="quit":
+        break
+      elif words[0]=="help":
+        self.help()
+      elif words[0]=="show" and len(words)==2 and words[1] in SLIDESHOWS:
+        self.engine.sendSlideshow(words[1])
+      elif words[0] in self.commands and len(words)==1:
+        self.commands[words[0]][0]()
+      else:
+        print("Unknown command. Type 'help' for a list of commands.")
+
+
+# Removes HTML tags from history entries, for front-ends that show plain text
+def strip_html(html):
+  text = ""
+  inside = False
+  for c in html:
+    if c=='<':
+      inside = True
+    elif c=='>':
+      inside = False
+    elif not inside:
+      text += c
+  return text
+
+
+# Starts the engine, or exits if another one is running in the same directory
+def start_engine(engine):
+  try:
+    engine.start()
+  except engineBusy as e:
+    print(e)
+    sys.exit(1)
+
+
+# Main
+def main():
+  # Load config
+  error = load_config()
+  if error!=None:
+    print(f"Could not load configuration file: {error}")
+    print(f"Configuration file should be named '{CONFIG_PATH}', located in the directory where the app is run, and needs to have this format and values:")
+    required, optional = CONFIG_SCHEMA.help()
+    for key, description in required:
+      print(f"  {key}=<{description}>")
+    print("Optional values:")
+    for key, description in optional:
+      print(f"  {key}=<{description}>")
+    sys.exit(1)
+  
+  engine = gameEngine()
+  # With '--daemon', the game runs without reading commands, and is controlled through the state files and displays
+  if "--daemon" in sys.argv[1:]:
+    engine.subscribe(historyEvent, lambda event: print(strip_html(event.html), flush=True))
+    engine.subscribe(healthEvent, lambda event: print(f"Lights: {event.detail}", flush=True))
+    start_engine(engine)
+    try:
+      while True:
+        time.sleep(3600)
+    except KeyboardInterrupt:
+      pass
+  else:
+    front_end = commandLine(engine)
+    start_engine(engine)
+    try:
+      front_end.run()
+    except KeyboardInterrupt:
+      pass
+  engine.halt()
+
+# Redirects to main
+if __name__=="__main__":
+  main()
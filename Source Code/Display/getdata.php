@@ -1,4 +1,13 @@
 <?php
 
-echo file_get_contents("start.txt").','."0".','.file_get_contents("hints.txt").','.file_get_contents("pause.txt");
+$data = file_get_contents("start.txt").','."0".','.file_get_contents("hints.txt").','.file_get_contents("pause.txt");
+// Let browsers revalidate instead of downloading the same data again
+$etag = '"'.md5($data).'"';
+header("ETag: ".$etag);
+header("Cache-Control: no-cache");
+if (isset($_SERVER["HTTP_IF_NONE_MATCH"]) && trim($_SERVER["HTTP_IF_NONE_MATCH"])==$etag) {
+  http_response_code(304);
+  exit;
+}
+echo $data;
 ?>
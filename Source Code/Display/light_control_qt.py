@@ -0,0 +1,368 @@
+# Qt parts of the light control server: screen blanking, session locking and prerendered slideshows.
+# They're kept in their own module, so that the server can start listening before PySide2 is loaded.
+from threading import Thread, Lock, current_thread
+from queue import Queue
+import os, glob, time, shutil, hashlib, subprocess
+from PySide2.QtWidgets import QWidget, QLabel, QVBoxLayout
+from PySide2.QtGui import Qt, QImage, QPixmap
+from PySide2.QtCore import QObject, Signal
+# Screen locking goes through dbus-python when it's available, otherwise the qdbus tool is used
+try:
+  import dbus
+except ModuleNotFoundError:
+  dbus = None
+# Seconds the Qt event loop can take to handle a posted event before it's considered frozen
+LOOP_STALL = 2
+# Seconds a screen saver call can take before the worker that made it is replaced
+LOCK_STALL = 30
+# Tools used to prerender slideshows
+RENDER_TOOLS = ("soffice", "pdftoppm")
+
+
+# Class that renders slideshows to images ahead of time, so that they can be shown instantly instead of waiting for LibreOffice to start.
+# Rendered slides are kept on disk, and are only rendered again when the slideshow file changes.
+class slideshowCache():
+  def __init__(self, decks, screen_size, directory):
+    self.decks = decks
+    self.directory = directory
+    self.size = screen_size
+    self.slides = dict()
+    self.failed = dict()
+    self.lock = Lock()
+    self.ready_pointer = None
+    self.thread = None
+    self.finished = False
+  
+  def start(self):
+    self.thread = Thread(target=self.__renderThread, daemon=True)
+    self.thread.start()
+  
+  # Returns the health of slideshow rendering, as a tuple of (ok, detail)
+  def health(self):
+    missing = [tool for tool in RENDER_TOOLS if shutil.which(tool)==None]
+    if len(missing)>0:
+      return False, f"Missing {', '.join(missing)}"
+    with self.lock:
+      ready, failed = len(self.slides), dict(self.failed)
+    if len(failed)>0:
+      return False, "; ".join(f"Could not prepare {name}: {error}" for name, error in failed.items())
+    if ready<len(self.decks):
+      return True, f"Rendering ({ready} of {len(self.decks)} ready)"
+    return True, f"{ready} slideshows ready"
+  
+  # Starts rendering again if the render thread stopped before it was done.
+  # Slideshows that failed aren't retried, since they'd most likely fail again.
+  def restart(self):
+    if self.finished or self.thread.is_alive():
+      return False
+    print("Restarting slideshow rendering")
+    self.start()
+    return True
+  
+  # Returns the rendered slides of a slideshow, or None if they aren't ready
+  def get(self, name):
+    with self.lock:
+      return self.slides.get(name)
+  
+  def __renderThread(self):
+    for name, path in self.decks.items():
+      if self.get(name) != None or name in self.failed:
+        continue
+      try:
+        images = self.__render(path)
+      except (OSError, ValueError, subprocess.SubprocessError) as e:
+        print(f"Could not prepare slideshow for hint {name}, LibreOffice will be used instead: {e}")
+        with self.lock:
+          self.failed[name] = str(e)
+        continue
+      with self.lock:
+        self.slides[name] = images
+      print(f"Slideshow for hint {name} is ready ({len(images)} slides)")
+      if self.ready_pointer != None:
+        self.ready_pointer(name)
+    self.finished = True
+  
+  # Converts a slideshow to a PDF with LibreOffice, then to one PNG per slide with pdftoppm
+  def __render(self, path):
+    stat = os.stat(path)
+    key = hashlib.sha1(f"{os.path.abspath(path)}:{stat.st_mtime_ns}:{stat.st_size}".encode()).hexdigest()[:16]
+    directory = os.path.join(self.directory, key)
+    pages = sorted(glob.glob(os.path.join(directory, "slide*.png")))
+    if len(pages)==0:
+      os.makedirs(directory, exist_ok=True)
+      # Use a separate LibreOffice profile, so that this doesn't interfere with any running instance
+      profile = "file://" + os.path.abspath(os.path.join(self.directory, "profile"))
+      subprocess.run(["soffice", f"-env:UserInstallation={profile}", "--headless", "--convert-to", "pdf", "--outdir", directory, path], check=True, capture_output=True, timeout=300)
+      pdf = os.path.join(directory, os.path.splitext(os.path.basename(path))[0]+".pdf")
+      subprocess.run(["pdftoppm", "-png", "-scale-to-x", str(self.size.width()), "-scale-to-y", "-1", pdf, os.path.join(directory, "slide")], check=True, capture_output=True, timeout=300)
+      pages = sorted(glob.glob(os.path.join(directory, "slide*.png")))
+    images = []
+    for page in pages:
+      image = QImage(page)
+      if image.isNull():
+        raise ValueError(f"could not load '{page}'")
+      images.append(image.scaled(self.size, Qt.KeepAspectRatio, Qt.SmoothTransformation))
+    if len(images)==0:
+      raise ValueError("slideshow has no slides")
+    return images
+
+
+# Full screen window that shows prerendered slideshows.
+# Requests from other threads go through signals, so that Qt handles them in the GUI thread.
+class slideshowWindow(QWidget):
+  showRequested = Signal(str)
+  advanceRequested = Signal()
+  readyRequested = Signal(str)
+  
+  def __init__(self, cache):
+    super().__init__()
+    self.cache = cache
+    self.active = False
+    self.pixmaps = dict()
+    self.slides = []
+    self.position = 0
+    self.setStyleSheet("background-color: black;")
+    self.mainLayout = QVBoxLayout(self)
+    self.mainLayout.setContentsMargins(0, 0, 0, 0)
+    self.label = QLabel(self)
+    self.label.setAlignment(Qt.AlignCenter)
+    self.mainLayout.addWidget(self.label)
+    self.showRequested.connect(self.showSlides)
+    self.advanceRequested.connect(self.advance)
+    self.readyRequested.connect(self.prepare)
+    self.cache.ready_pointer = self.readyRequested.emit
+  
+  # Returns True if a slideshow was rendered and can be shown
+  def ready(self, name):
+    return self.cache.get(name) != None
+  
+  # Converts rendered slides to pixmaps as soon as they're ready, so that showing them takes no time
+  def prepare(self, name):
+    self.pixmaps[name] = [QPixmap.fromImage(image) for image in self.cache.get(name)]
+  
+  def showSlides(self, name):
+    if name not in self.pixmaps:
+      self.prepare(name)
+    self.slides = self.pixmaps[name]
+    self.position = 0
+    self.label.setPixmap(self.slides[0])
+    self.show()
+    self.raise_()
+    self.activateWindow()
+  
+  # Moves to another slide, and closes the slideshow when going past the last one
+  def advance(self, step=1):
+    self.position = max(0, self.position+step)
+    if self.position >= len(self.slides):
+      self.hide()
+    else:
+      self.label.setPixmap(self.slides[self.position])
+  
+  def keyPressEvent(self, e):
+    if e.key() in (Qt.Key_Space, Qt.Key_Right, Qt.Key_Down, Qt.Key_PageDown, Qt.Key_Return, Qt.Key_Enter):
+      self.advance()
+    elif e.key() in (Qt.Key_Left, Qt.Key_Up, Qt.Key_PageUp, Qt.Key_Backspace):
+      self.advance(-1)
+    elif e.key() == Qt.Key_Escape:
+      self.hide()
+  
+  def mousePressEvent(self, e):
+    self.advance()
+  
+  # Track if a slideshow is being shown
+  def showEvent(self, e):
+    self.active = True
+    self.setWindowState(self.windowState() | Qt.WindowFullScreen)
+  def hideEvent(self, e):
+    self.active = False
+
+
+# Class that locks and unlocks the session through the desktop's screen saver D-Bus service.
+# Calls are made from a worker thread, and results come back to the GUI thread through a signal, so that a slow D-Bus call never freezes the GUI.
+class screenLocker(QObject):
+  finished = Signal(bool, str)
+  
+  def __init__(self):
+    super().__init__()
+    self.queue = Queue()
+    self.pending_lock = Lock()
+    self.pending = None
+    self.interface = None
+    # When the call that the worker is making started, or None if it's waiting
+    self.busy_since = None
+    self.finished.connect(self.report)
+    self.worker = None
+    self.restart()
+  
+  # Asks for the session to be locked or unlocked, without waiting for the result.
+  # If a request is still waiting to be sent, it's replaced instead of queueing another one.
+  def setLocked(self, locked):
+    with self.pending_lock:
+      queued = self.pending != None
+      self.pending = locked
+    if not queued:
+      self.queue.put(None)
+  
+  def lock(self):
+    self.setLocked(True)
+  
+  def unlock(self):
+    self.setLocked(False)
+  
+  # Returns the health of the worker thread, as a tuple of (ok, detail)
+  def health(self):
+    if not self.worker.is_alive():
+      return False, "Worker thread stopped"
+    busy_since = self.busy_since
+    if busy_since != None and time.monotonic()-busy_since > LOCK_STALL:
+      return False, f"Screen saver call stuck for {time.monotonic()-busy_since:.0f} s"
+    if self.interface != None:
+      return True, "D-Bus"
+    if shutil.which("qdbus") == None:
+      return False, "Screen saver service and qdbus are unavailable"
+    return True, "qdbus"
+  
+  # Starts a new worker thread, if there's none or the current one stopped or got stuck.
+  # A stuck worker exits once its call returns, since it's no longer the current one.
+  # A missing screen saver service is only reported, since a new worker wouldn't find one either.
+  def restart(self):
+    busy_since = self.busy_since
+    stuck = busy_since != None and time.monotonic()-busy_since > LOCK_STALL
+    if self.worker != None and self.worker.is_alive() and not stuck:
+      return False
+    if self.worker != None:
+      print("Restarting screen lock worker")
+    self.busy_since = None
+    self.worker = Thread(target=self.__workerThread, daemon=True)
+    self.worker.start()
+    return True
+  
+  # Logs results in the GUI thread
+  def report(self, success, message):
+    if not success:
+      print(f"Couldn't lock session: {message}")
+  
+  # Connects to the session bus once, and reconnects only if a call fails
+  def __connect(self):
+    if dbus == None:
+      return
+    try:
+      bus = dbus.SessionBus()
+      proxy = bus.get_object("org.freedesktop.ScreenSaver", "/ScreenSaver")
+      self.interface = dbus.Interface(proxy, "org.freedesktop.ScreenSaver")
+    except dbus.DBusException as e:
+      print(f"Couldn't connect to screen saver service, qdbus will be used instead: {e}")
+      self.interface = None
+  
+  def __workerThread(self):
+    self.__connect()
+    while current_thread() is self.worker:
+      self.queue.get()
+      with self.pending_lock:
+        locked, self.pending = self.pending, None
+      if locked:
+        print("Showing lock screen")
+      self.busy_since = time.monotonic()
+      try:
+        if self.interface != None:
+          self.interface.SetActive(locked, timeout=15)
+        else:
+          subprocess.run(["qdbus", "org.freedesktop.ScreenSaver", "/ScreenSaver", "org.freedesktop.ScreenSaver.SetActive", "true" if locked else "false"], timeout=15, check=True)
+        self.finished.emit(True, "")
+      except Exception as e:
+        self.finished.emit(False, str(e))
+        # The session bus might have been restarted, so try connecting again for the next call
+        if self.interface != None:
+          self.__connect()
+      self.busy_since = None
+
+
+# Screen blanking class
+class screenBlanker(QWidget):
+  def __init__(self, locker):
+    super().__init__()
+    self.locker = locker
+    self.active = False
+  # Track if screen is blanked or not
+  def showEvent(self, e):
+    self.active = True
+    self.setWindowState(self.windowState() | Qt.WindowFullScreen)
+  def hideEvent(self, e):
+    # If the screen was blanked, ask the desktop manager to lock the session.
+    # This doesn't wait for the desktop to answer.
+    if self.active:
+      self.locker.lock()
+    self.active = False
+
+
+# Class that passes screen blanking requests from HTTP and scheduler threads to the GUI thread.
+# Widgets can only be used from the GUI thread, so requests are posted to the Qt event loop with a queued signal.
+# Only the latest request matters, so bursts of show/hide requests turn into at most one change.
+# Hiding the blanker locks the session though, so a blank that's undone before it's shown still locks it.
+class displayBridge(QObject):
+  changed = Signal()
+  
+  def __init__(self, blanker):
+    super().__init__()
+    self.blanker = blanker
+    self.lock = Lock()
+    self.blank = None
+    # Set if blanking was asked for since the GUI thread last handled a request
+    self.blanked = False
+    self.changed.connect(self.apply, Qt.QueuedConnection)
+  
+  # Asks for the screen to be blanked or unblanked. Can be called from any thread.
+  def setBlank(self, blank):
+    with self.lock:
+      posted = self.blank != None
+      self.blank = blank
+      self.blanked = self.blanked or blank
+    # No need to post again if the GUI thread hasn't handled the last request yet
+    if not posted:
+      self.changed.emit()
+  
+  # Applies the latest request in the GUI thread, skipping it if there's nothing to change
+  def apply(self):
+    with self.lock:
+      blank, self.blank = self.blank, None
+      blanked, self.blanked = self.blanked, False
+    if blank and not self.blanker.isVisible():
+      self.blanker.show()
+    elif blank == False and self.blanker.isVisible():
+      self.blanker.hide()
+    # Blanked and unblanked before the GUI thread got to it: lock the session, like hiding the blanker would have
+    elif blank == False and blanked:
+      self.blanker.locker.lock()
+
+
+# Class that measures how long the Qt event loop takes to handle a posted event, so that a frozen GUI thread is noticed
+class loopProbe(QObject):
+  pinged = Signal(float)
+  
+  def __init__(self):
+    super().__init__()
+    self.lock = Lock()
+    self.sent = None
+    self.latency = None
+    self.pinged.connect(self.answer, Qt.QueuedConnection)
+  
+  # Called in the GUI thread once the event loop gets to the ping
+  def answer(self, sent):
+    with self.lock:
+      if sent == self.sent:
+        self.latency = time.perf_counter()-sent
+        self.sent = None
+  
+  # Reports how long the last ping took, and sends another one. Called by the health monitor.
+  def health(self):
+    now = time.perf_counter()
+    with self.lock:
+      sent, latency = self.sent, self.latency
+      if sent == None:
+        self.sent = now
+    if sent != None:
+      return now-sent <= LOOP_STALL, f"Waiting for event loop for {(now-sent)*1000:.0f} ms"
+    self.pinged.emit(now)
+    if latency == None:
+      return True, "Starting"
+    return True, f"Event loop answered in {latency*1000:.1f} ms"
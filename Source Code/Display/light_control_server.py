@@ -1,31 +1,78 @@
 #!/bin/python3
-from http.server import HTTPServer, BaseHTTPRequestHandler
-from threading import Thread, Lock
-import os, sys, time, signal, platform, subprocess
+import time
+# Used to measure how long startup takes
+STARTUP_TIME = time.perf_counter()
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from threading import Thread, Lock, Condition, Event
+from urllib.parse import urlparse, parse_qs, unquote
+from functools import lru_cache
+from queue import Queue
+from http.client import HTTPConnection
+import os, re, sys, json, math, base64, shutil, signal, hashlib, platform, subprocess, importlib.util
+from config_schema import schema, setting, configError, integer, number, choice, listing, port
 
 # Show warning if not running on Linux
 if platform.system()!="Linux":
   print(f"\033[1m\033[93mUnsupported platform ({platform.system()}) was detected. This script was designed for Linux,\nand might run unreliably on other operating systems.\033[0m\n")
 # Show friendly error message if dependencies aren't met.
-try:
-  import serial
-except ModuleNotFoundError:
+# They're only imported once they're needed, so that the HTTP server can start listening sooner.
+if importlib.util.find_spec("serial")==None:
   print("This script depends on the PySerial library, use the following command to install it:")
   print("pip3 install pyserial")
   sys.exit(2)
-try:
-  from PySide2.QtWidgets import QApplication, QWidget
-  from PySide2.QtGui import Qt
-except ModuleNotFoundError:
+if importlib.util.find_spec("PySide2")==None:
   print("This script depends on the PySide2 library. It should be available on your distribution's repositories, otherwise use the following command to install it:")
   print("pip3 install pyside2")
   sys.exit(2)
+serial = None
+game_core = None
 
-config = dict()
+config = None
 CONFIG_PATH = "light_control_server.conf"
-# LED Strip communication and screen blanker objects must be available globally, due to http.server limitations
-strip = None
-blanker = None
+# Name of the zone that uses the top level serial and color settings
+MAIN_ZONE = "main"
+# Settings each zone can have on its own
+ZONE_SETTINGS = ("serial", "base-color", "hint-color-bright", "hint-color-dark", "victory-color")
+# Color names that cues can use, resolved separately for each zone
+ZONE_TARGETS = ("base", "hint-bright", "hint-dark", "victory")
+# Key names that can be pressed, alone or combined with '+'
+KEY_PATTERN = re.compile(r"[A-Za-z0-9_]+(\+[A-Za-z0-9_]+)*")
+# Modifier names accepted by xdotool, and the keys they stand for
+KEY_ALIASES = {"ctrl": "Control_L", "alt": "Alt_L", "shift": "Shift_L", "super": "Super_L"}
+# Slideshows that can be shown with '/show-<name>', and the config attributes with their paths
+SLIDESHOWS = {"8.1": "slideshow8_1_path", "8.2": "slideshow8_2_path"}
+# LED Strip scheduler, display bridge, slideshow and keyboard objects must be available globally, due to http.server limitations
+lights = None
+display = None
+slideshow = None
+keyboard = None
+# Set once the LED strips, and the Qt parts of the server are ready
+lights_ready = Event()
+display_ready = Event()
+# Seconds a request waits for the part of the server it needs to start
+STARTUP_WAIT = 30
+# Game engine of the web operator panel, if it's enabled
+panel = None
+panel_ready = Event()
+# Page of the web operator panel, served at '/panel'
+PANEL_PAGE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "operator_panel.html")
+# Game engine actions the web operator panel can take, besides sending slideshows
+PANEL_ACTIONS = ("toggleTimer", "reset", "addHint", "removeHint", "victoryLights", "resetLights", "blankScreen", "pressSpace")
+# Used to answer WebSocket handshakes, as defined by RFC 6455
+WEBSOCKET_GUID = b"258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+# Largest message accepted from an operator panel, in bytes
+WEBSOCKET_MAX_MESSAGE = 65536
+# Seconds between pings sent to operator panels, so that dead connections are noticed
+WEBSOCKET_KEEPALIVE = 15
+# Seconds between health checks, and how long the HTTP server gets to answer one
+HEALTH_INTERVAL = 5
+HEALTH_TIMEOUT = 5
+# Seconds the strip scheduler can go without running before it's considered stalled
+SCHEDULER_STALL = 15
+# Seconds a write to an LED strip can take before it's given up on
+SERIAL_WRITE_TIMEOUT = 1
+# Health monitor and watchdog of the server's parts
+monitor = None
 
 # Color class
 class color():
@@ -89,138 +136,276 @@ class color():
         hue = (hue+1)%6
       # Return colored text
       return new_text + "\033[0m"
-  
 
-# Load configuration file
+  # Returns color in the given interpolation space, as a tuple of floats
+  # Rainbow colors only have one channel (the hue), which isn't light, so it always stays as a raw value
+  def toSpace(self, space):
+    if self.cltype == "H":
+      return (float(self.value),)
+    channels = (self.red, self.green, self.blue)
+    # Raw sRGB bytes, same as the old behavior
+    if space == "srgb":
+      return tuple(float(c) for c in channels)
+    linear = tuple(SRGB_TO_LINEAR[c] for c in channels)
+    if space == "linear":
+      return linear
+    return linear_to_oklab(*linear)
+
+
+# Lookup table that converts 8-bit sRGB channel values to linear light
+SRGB_TO_LINEAR = tuple((c/255)/12.92 if c/255 <= 0.04045 else pow((c/255+0.055)/1.055, 2.4) for c in range(256))
+
+# Cube root that also works with negative numbers
+def cbrt(x):
+  return math.copysign(pow(abs(x), 1/3), x)
+
+# Converts a linear light channel value back to an 8-bit sRGB value
+def linear_to_srgb(v):
+  if v <= 0.0031308:
+    v = v*12.92
+  else:
+    v = 1.055*pow(v, 1/2.4) - 0.055
+  return min(255, max(0, round(v*255)))
+
+# Converts linear RGB to OKLab (https://bottosson.github.io/posts/oklab/)
+def linear_to_oklab(r, g, b):
+  l = cbrt(0.4122214708*r + 0.5363325363*g + 0.0514459929*b)
+  m = cbrt(0.2119034982*r + 0.6806995451*g + 0.1073969566*b)
+  s = cbrt(0.0883024619*r + 0.2817188376*g + 0.6299787005*b)
+  return (0.2104542553*l + 0.7936177850*m - 0.0040720468*s,
+          1.9779984951*l - 2.4285922050*m + 0.4505937099*s,
+          0.0259040371*l + 0.7827717662*m - 0.8086757660*s)
+
+# Converts OKLab back to linear RGB
+def oklab_to_linear(L, a, b):
+  l = pow(L + 0.3963377774*a + 0.2158037573*b, 3)
+  m = pow(L - 0.1055613458*a - 0.0638541728*b, 3)
+  s = pow(L - 0.0894841775*a - 1.2914855480*b, 3)
+  return (4.0767416621*l - 3.3077115913*m + 0.2309699292*s,
+          -1.2684380046*l + 2.6097574011*m - 0.3413193965*s,
+          -0.0041960863*l - 0.7034186147*m + 1.7076147010*s)
+
+# Converts a tuple from an interpolation space back to 8-bit channel values
+# Rainbow colors have a single raw channel, whatever the space
+def from_space(values, space):
+  if space == "srgb" or len(values) == 1:
+    return tuple(min(255, max(0, int(v))) for v in values)
+  if space == "oklab":
+    values = oklab_to_linear(*values)
+  return tuple(linear_to_srgb(v) for v in values)
+
+# Easing curves, mapping transition progress (0-1) to interpolation amount (0-1)
+EASING_CURVES = {
+  "linear":      lambda t: t,
+  "ease-in":     lambda t: t*t,
+  "ease-out":    lambda t: 1 - (1-t)*(1-t),
+  "ease-in-out": lambda t: t*t*(3 - 2*t),
+  "sine":        lambda t: (1 - math.cos(math.pi*t))/2,
+}
+INTERPOLATION_SPACES = ("srgb", "linear", "oklab")
+
+# Evaluates an easing curve for every sample of a transition at once.
+# Tables are cached, since the same curve and sample count get reused for every fade.
+@lru_cache(maxsize=32)
+def easing_table(curve, total_samples):
+  ease = EASING_CURVES[curve]
+  return tuple(ease(i/total_samples) for i in range(1, total_samples+1))
+
+# Precomputes all the serial messages needed to fade from one color to another.
+# Both colors must be of the same type.
+def transition_frames(old, new, total_samples, space=None, curve=None):
+  space = space or config.interpolation
+  curve = curve or config.easing
+  if total_samples < 1:
+    return [new.hexbytes]
+  start = old.toSpace(space)
+  delta = tuple(n-s for s, n in zip(start, new.toSpace(space)))
+  frames = []
+  for k in easing_table(curve, total_samples):
+    channels = from_space(tuple(s + d*k for s, d in zip(start, delta)), space)
+    if old.cltype == "S":
+      frames.append(bytes("$S#%02X%02X%02X"%channels,'utf-8'))
+    else:
+      frames.append(bytes("$H#%02X"%channels,'utf-8'))
+  # Make sure rounding errors don't keep us from landing exactly on the target color
+  if new.cltype == "S":
+    frames[-1] = bytes("$S#%02X%02X%02X"%(new.red,new.green,new.blue),'utf-8')
+  else:
+    frames[-1] = bytes("$H#%02X"%(new.value,),'utf-8')
+  return frames
+
+# Converts a config value to a color, checking that it's a hexcode my Arduino LED strip controller software accepts
+def color_value(value):
+  if not re.fullmatch(r"\$S#[0-9A-Fa-f]{6}|\$H#[0-9A-Fa-f]{2}", value):
+    raise ValueError("must be $S#RRGGBB for a static color, or $H#VV for rainbow")
+  return color(value)
+
+# Checks that every zone has its own serial port and a name that can be used in requests
+def check_zones(config):
+  for name, zone in config.zones.items():
+    key = f"zone.{name}.{next(iter(zone))}"
+    if name==MAIN_ZONE:
+      raise configError(f"Zone '{MAIN_ZONE}' uses the top level settings, it can't be declared with '{key}'", config.origin(key))
+    if "serial" not in zone:
+      raise configError(f"Zone '{name}' doesn't have a 'zone.{name}.serial' value", config.origin(key))
+
+# Checks that groups only list zones that exist
+def check_groups(config):
+  for name, members in config.groups.items():
+    key = f"group.{name}"
+    if name=="all":
+      raise configError("Group 'all' is reserved, it can't be declared in the config file", config.origin(key))
+    for zone in members:
+      if zone!=MAIN_ZONE and zone not in config.zones:
+        raise configError(f"Group '{name}' lists unknown zone '{zone}'", config.origin(key))
+
+# Settings of the config file. Additional zones are declared with 'zone.<name>.<setting>' keys, and need at least a
+# serial port; zones without their own colors use the main colors. Groups are comma separated lists of zones.
+CONFIG_SCHEMA = schema("lightConfig", [
+  setting("base-color", color_value, description="$(S for static color or H for rainbow)#(Hex value color)"),
+  setting("hint-color-bright", color_value, description="$(S for static color or H for rainbow)#(Hex value color)"),
+  setting("hint-color-dark", color_value, description="$(S for static color or H for rainbow)#(Hex value color)"),
+  setting("hint-transition", number(0), description="Number of seconds, can be a decimal number. Used for transition between bright and dark hint color"),
+  setting("victory-color", color_value, description="$(S for static color or H for rainbow)#(Hex value color)"),
+  setting("transition", number(0), description="Number of seconds, can be a decimal number"),
+  setting("hostname", description="Address from which the server should listen. This should be your device's internal IP address"),
+  setting("port", port, description="Network port for the server to listen to. This should be an integer between 0-65535 inclusive"),
+  setting("serial", description="Path to serial port that connects to an Arduino controlling an LED strip"),
+  setting("baudrate", integer(1), description="Integer that indicates what baud rate to use for serial communication with the Arduino"),
+  setting("samplerate", integer(1), description="Integer that indicates how many color samples per second are sent to the LED strip during transitions"),
+  setting("slideshow8.1-path", description="Path to slideshow for hint 8.1"),
+  setting("slideshow8.2-path", description="Path to slideshow for hint 8.2"),
+  setting("interpolation", choice(*INTERPOLATION_SPACES), "oklab", f"Color space used for transitions: {', '.join(INTERPOLATION_SPACES)}. Defaults to oklab"),
+  setting("easing", choice(*EASING_CURVES), "linear", f"Transition curve: {', '.join(EASING_CURVES)}. Defaults to linear"),
+  setting("cue-directory", default="cues", description="Directory with lighting cue files, played with '/cue/<name>'. Defaults to 'cues'"),
+  setting("slideshow-cache", default=".slideshow-cache", description="Directory where prerendered slideshows are kept. Defaults to '.slideshow-cache'"),
+  setting("zone.*.serial", default=None, description="Path to serial port of an additional LED strip zone", attribute="zones", field="serial"),
+] + [
+  setting(f"zone.*.{key}", color_value, None, f"Color override for a zone, instead of {key}", attribute="zones", field=key)
+  for key in ZONE_SETTINGS[1:]
+] + [
+  setting("group.*", listing, None, "Comma separated list of zones that can be addressed together with '?group=<name>'. The main zone is called 'main'", attribute="groups"),
+  setting("panel-directory", default=None, description="Directory where the creator panel runs, with its config and timer files. Enables the web operator panel at '/panel'. The creator panel can't run there at the same time"),
+], (check_zones, check_groups))
+
+# Load configuration file. Returns None if successful, or a message that says what's wrong.
 def load_config():
   global config
-  
-  # Abort if config file doesn't exist
-  if not os.path.exists(CONFIG_PATH):
-    return False
-  
-  base_color_set        = False
-  hint_color_bright_set = False
-  hint_color_dark_set   = False
-  hint_transition_set   = False
-  finish_color_set      = False
-  transition_set        = False
-  hostname_set          = False
-  port_set              = False
-  serial_set            = False
-  baudrate_set          = False
-  samplerate_set        = False
-  slideshow8_1_set      = False
-  slideshow8_2_set      = False
-  
-  # Read config file
-  with open(CONFIG_PATH,'r') as config_f:
-    for line in config_f.readlines():
-      separator = line.find('=')
-      # Skip line if it doesn't follow the format 'key=value'
-      if separator==-1:
-        continue
-      # Split each line to key and value
-      key = line[0:separator].strip()
-      value = line[separator+1:].strip()
-      config[key] = value
-      # Check if this is one of the required keys
-      if key=="base-color":
-        base_color_set = True
-      elif key=="hint-color-bright":
-        hint_color_bright_set = True
-      elif key=="hint-color-dark":
-        hint_color_dark_set = True
-      elif key=="hint-transition":
-        hint_transition_set = True
-      elif key=="victory-color":
-        finish_color_set = True
-      elif key=="transition":
-        transition_set = True
-      elif key=="hostname":
-        hostname_set = True
-      elif key=="port":
-        port_set = True
-      elif key=="serial":
-        serial_set = True
-      elif key=="baudrate":
-        baudrate_set = True
-      elif key=="samplerate":
-        samplerate_set = True
-      elif key=="slideshow8.1-path":
-        slideshow8_1_set = True
-      elif key=="slideshow8.2-path":
-        slideshow8_2_set = True
-      else:
-        print(f"Unused value '{line.strip()}' found in config file")
-  # Abort if not all required values were set
-  if not (base_color_set and hint_color_bright_set and hint_color_dark_set and hint_transition_set and finish_color_set and transition_set and hostname_set and port_set and serial_set and baudrate_set and samplerate_set and slideshow8_1_set and slideshow8_2_set):
-    return False
-  
-  # Convert transition time to an floating point number, or abort if it's invalid or out of range
-  # Also convert color hexcodes to color classes, and port to integer
   try:
-    config["transition"] = float(config["transition"])
-    config["base-color"] = color(config["base-color"])
-    config["hint-color-bright"] = color(config["hint-color-bright"])
-    config["hint-color-dark"] = color(config["hint-color-dark"])
-    config["hint-transition"] = float(config["hint-transition"])
-    config["victory-color"] = color(config["victory-color"])
-    config["port"] = int(config["port"])
-    config["baudrate"] = int(config["baudrate"])
-    config["samplerate"] = int(config["samplerate"])
-  except:
-    return False
-  
-  # Abort if port out of range
-  if config["port"]<0 or config["port"]>65535:
+    config = CONFIG_SCHEMA.load(CONFIG_PATH)
+  except configError as e:
+    return str(e)
+  return None
+
+
+# Runs a command, given as a request path and its parsed query. Returns False if the command is invalid,
+# or None if the part of the server it needs didn't finish starting in time.
+# Used for both HTTP requests and cue triggers.
+def run_command(path, query):
+  # Wait for the parts of the server this command needs, if they're still starting
+  light_command = path in ("/base", "/hint", "/victory", "/cue-stop") or path.startswith("/cue/")
+  if light_command and not wait_ready(lights_ready):
+    return None
+  if (path=="/base" or not light_command) and not wait_ready(display_ready):
+    return None
+  # Light requests can be limited to some zones with '?zone=a,b' or '?group=name'
+  if light_command:
+    zones = lights.resolve(query.get("zone", []), query.get("group", []))
+    if zones==None:
+      return False
+  # Base color request
+  if path=="/base":
+    print(config.base_color.escapify("Changing to base color")+lights.describe(zones))
+    lights.trigger(zones, "base")
+    display.setBlank(False)
+  # Hint color request
+  elif path=="/hint":
+    print(config.hint_color_bright.escapify("Changing to"),end='')
+    print(config.hint_color_dark.escapify(" hint color")+lights.describe(zones))
+    lights.trigger(zones, "hint")
+  # Victory color request
+  elif path=="/victory":
+    print(config.victory_color.escapify("Changing to victory color")+lights.describe(zones))
+    lights.trigger(zones, "victory")
+  # Cue requests, in the form of '/cue/<name>'
+  elif path.startswith("/cue/"):
+    name = path[5:]
+    if name not in lights.cues:
+      return False
+    # Use the zones from the cue file, unless the request asks for specific ones
+    if "zone" not in query and "group" not in query:
+      zones = lights.resolve(lights.cues[name].zones, lights.cues[name].groups)
+      if zones==None:
+        return False
+    print(f"Starting cue '{name}'"+lights.describe(zones))
+    lights.startCue(zones, lights.cues[name])
+  elif path=="/cue-stop":
+    print("Stopping cues"+lights.describe(zones))
+    lights.stopCue(zones)
+  # Screen blank request
+  elif path=="/blank":
+    print(color('$S#000000').escapify("Blanking screen"))
+    display.setBlank(True)
+  # Hints that show a slideshow on screen. Prerendered slides are used when ready, otherwise LibreOffice is started.
+  elif path.startswith("/show-") and path[6:] in SLIDESHOWS:
+    name = path[6:]
+    print(f"Showing slideshow for hint {name}")
+    if slideshow.ready(name):
+      slideshow.showRequested.emit(name)
+    else:
+      subprocess.Popen(["/usr/bin/soffice", "--show", getattr(config, SLIDESHOWS[name])])
+  # Space keystroke request, which goes straight to the prerendered slideshow if it's being shown
+  elif path=="/space":
+    print("Pressing space key")
+    if slideshow.active:
+      slideshow.advanceRequested.emit()
+    else:
+      keyboard.press(["space"])
+  # Keystroke requests, in the form of '/key/<key>' for one key or key combination (like 'ctrl+Right'),
+  # and '/keys/<key>,<key>,...' for a sequence of them
+  elif path.startswith("/key/") or path.startswith("/keys/"):
+    keys = unquote(path[path.index('/',1)+1:]).split(',')
+    if path.startswith("/key/") and len(keys)!=1:
+      return False
+    print(f"Pressing {', '.join(keys)}")
+    if not keyboard.press(keys):
+      return False
+  # Invalid request
+  else:
     return False
-  
-  # Everything was successful
   return True
 
 
 # Class that handles client requests
 class RequestHandler(BaseHTTPRequestHandler):
-  global ledstrip
   # This function is called by the http.server class whenever a client makes a request.
   def do_GET(self):
-    invalid = False
-    # Base color request
-    if self.path=="/base":
-      print(config['base-color'].escapify("Changing to base color"))
-      strip.change("base")
-      blanker.hide()
-    # Hint color request
-    elif self.path=="/hint":
-      print(config['hint-color-bright'].escapify("Changing to"),end='')
-      print(config['hint-color-dark'].escapify(" hint color"))
-      strip.startHintMode()
-    # Victory color request
-    elif self.path=="/victory":
-      print(config['victory-color'].escapify("Changing to victory color"))
-      strip.change("victory")
-    # Screen blank request
-    elif self.path=="/blank":
-      print(color('$S#000000').escapify("Blanking screen"))
-      blanker.show()
-    # Hints that show a slideshow on screen
-    elif self.path=="/show-8.1":
-      print("Showing slideshow for hint 8.1")
-      subprocess.Popen(["/usr/bin/soffice", "--show", config["slideshow8.1-path"]])
-    elif self.path=="/show-8.2":
-      print("Showing slideshow for hint 8.2")
-      subprocess.Popen(["/usr/bin/soffice", "--show", config["slideshow8.2-path"]])
-    # Space keystroke request
-    elif self.path=="/space":
-      print("Pressing space key")
-      subprocess.Popen(["xdotool", "key", "space"])
-    # Invalid request
-    else:
-      invalid = True
-    
+    url = urlparse(self.path)
+    # Health report, with a 503 status if anything is wrong, and a request the watchdog uses to check that we answer
+    if url.path=="/health":
+      report = monitor.report()
+      body = json.dumps(report).encode()
+      self.send_response(200 if report["ok"] else 503)
+      self.send_header("Content-Type", "application/json")
+      self.send_header("Content-Length", str(len(body)))
+      self.send_header("Access-Control-Allow-Origin", "*")
+      self.end_headers()
+      self.wfile.write(body)
+      return
+    if url.path=="/health/ping":
+      self.send_response(200)
+      self.end_headers()
+      return
+    if url.path in ("/panel", "/panel/socket"):
+      self.panelRequest(url.path)
+      return
+    result = run_command(url.path, parse_qs(url.query))
     # Respond based on the validity of the request
-    if invalid:
+    if result==None:
+      self.send_response(503)
+      self.end_headers()
+      self.wfile.write(b"Server is still starting.")
+    elif not result:
       self.send_response(404)
       self.end_headers()
       self.wfile.write(b"Invalid request.")
@@ -228,192 +413,939 @@ class RequestHandler(BaseHTTPRequestHandler):
       self.send_response(200)
       self.end_headers()
       self.wfile.write(b"Received request.")
+  
+  # Serves the web operator panel's page, or its WebSocket connection to the game engine
+  def panelRequest(self, path):
+    if config.panel_directory==None:
+      self.send_response(404)
+      self.end_headers()
+      self.wfile.write(b"Operator panel is disabled.")
+    elif not wait_ready(panel_ready):
+      self.send_response(503)
+      self.end_headers()
+      self.wfile.write(b"Server is still starting.")
+    elif panel==None:
+      self.send_response(404)
+      self.end_headers()
+      self.wfile.write(b"Operator panel is disabled.")
+    elif path=="/panel":
+      with open(PANEL_PAGE, "rb") as page_f:
+        page = page_f.read()
+      self.send_response(200)
+      self.send_header("Content-Type", "text/html; charset=utf-8")
+      self.send_header("Content-Length", str(len(page)))
+      self.end_headers()
+      self.wfile.write(page)
+    elif self.headers.get("Upgrade", "").lower()!="websocket" or self.headers.get("Sec-WebSocket-Key")==None:
+      self.send_response(400)
+      self.end_headers()
+      self.wfile.write(b"Expected a WebSocket connection.")
+    else:
+      accept = base64.b64encode(hashlib.sha1(self.headers["Sec-WebSocket-Key"].strip().encode()+WEBSOCKET_GUID).digest())
+      # Browsers only accept the handshake from HTTP/1.1
+      self.protocol_version = "HTTP/1.1"
+      self.send_response(101)
+      self.send_header("Upgrade", "websocket")
+      self.send_header("Connection", "Upgrade")
+      self.send_header("Sec-WebSocket-Accept", accept.decode())
+      self.end_headers()
+      self.close_connection = True
+      panelConnection(self.rfile, self.wfile).run()
+  
+  # Health checks are made every few seconds, so they're left out of the log.
+  # Malformed requests are rejected before their path is parsed, so it might not be set.
+  def log_message(self, format, *args):
+    if not getattr(self, "path", "").startswith("/health"):
+      super().log_message(format, *args)
 
-# Class that handles connection to Arduino that controls the LED strip
+# Class that handles connection to one of the Arduinos that control the LED strips.
+# Frames are written by the strip scheduler's thread; other threads only queue transitions and cues through the scheduler.
 class ledstrip():
-  def __init__(self):
-    self.lock = Lock()
-    self.hintmode_lock = Lock()
-    self.hintmode = False
+  def __init__(self, name, serial_path, colors):
+    self.name = name
+    self.colors = colors
+    self.color = colors["base"]
+    # Frames that are currently being written, and how many of them were written.
+    # A None frame means nothing needs to be sent on that tick.
+    self.frames = None
+    self.position = 0
+    self.target = None
+    self.last_frame = None
+    # Cue that is currently playing, and the iterator that provides its frames
+    self.cue = None
+    self.program = None
+    # Set when an endless cue can't be written, so that it waits for the watchdog to find the device again
+    self.offline = False
+    # Last error of the serial port, cleared once a frame is written, and when a frame was last written
+    self.last_error = None
+    self.last_write = None
+    # Identity of the device node that was last opened, which changes when the device is plugged in again
+    self.device = None
     # Track if connection was made to LED strip
     self.init_success = False
     try:
-      # Create serial connection
+      # Create serial connection. Writes time out, so that a device that stops responding can't stall the scheduler.
       self.port = serial.Serial()
-      self.port.port = config["serial"]
-      self.port.baudrate = config["baudrate"]
+      self.port.port = serial_path
+      self.port.baudrate = config.baudrate
+      self.port.write_timeout = SERIAL_WRITE_TIMEOUT
       self.port.open()
+      self.device = device_id(serial_path)
       # Set base color
-      self.color = config["base-color"]
       self.port.write(self.color.hexbytes)
+      self.last_write = time.monotonic()
       self.init_success = True
-    except FileNotFoundError:
-      print("Could not connect to LED strip: Device was disconnected")
-    except PermissionError:
-      print("Could not connect to LED strip: Access denied")
     except OSError as e:
-      print("Could not connect to LED strip:", end=' ')
-      if e.errno==2:
-        print("Device not connected")
-      elif e.errno==13:
-        print("Access denied")
-      else:
-        print(e)
+      self.last_error = serial_error(e)
+      print(f"Could not connect to LED strip '{name}': {self.last_error}")
     except BaseException as e:
       self.port.close()
       raise e
     # Close port, so that if the device gets randomly disconnected and reconnected, it won't cause issues.
     self.port.close()
   
-  # Transitions LED strip color from current color to specified one
-  def change(self, target, hint_transition=False):
-    # Disable hint mode if switching to a non-hint color
-    if target[0:4]!="hint":
-      self.stopHintMode()
-    self.lock.acquire()
-    # Track if we successfully did a smooth transition
-    success = True
+  # Returns True if there's anything left to write
+  def busy(self):
+    return self.frames != None or self.program != None
+  
+  # Queues a transition from the current color to the specified one, stopping any cue that is playing
+  def startTransition(self, target):
+    new_color = self.colors.get(target)
+    if new_color == None:
+      print("Declined request to change to invalid color target")
+      return
+    self.stop()
+    # Skip changing if new color is the same as the old one
+    if new_color == self.color:
+      return
+    self.frames = fade_frames(self.color, new_color, int(config.samplerate*config.transition))
+    self.position = 0
+    self.target = new_color
+  
+  # Starts playing a cue. Only the leader strip of a cue fires its triggers, so that they fire once.
+  def startCue(self, cue, leader):
+    self.stop()
+    self.cue = cue
+    self.program = cue.play(self, leader)
+  
+  # Drops the running transition or cue, keeping the color that was last written
+  def stop(self):
+    if self.frames != None:
+      self.updateColor(False)
+    self.frames = None
+    self.cue = None
+    self.program = None
+    self.offline = False
+    self.port.close()
+  
+  # Writes the current color again, or resumes the cue that was waiting, once the device is back.
+  # The Arduino goes back to its default color when it's plugged in again, so the color needs to be sent even if nothing changed.
+  def reconnect(self):
+    self.device = device_id(self.port.port)
+    if self.offline:
+      self.offline = False
+    elif not self.busy():
+      self.frames = [self.color.hexbytes]
+      self.position = 0
+      self.target = self.color
+      self.last_frame = None
+  
+  # Returns the health of the strip's serial link, as a tuple of (ok, detail)
+  def health(self):
+    device = device_id(self.port.port)
+    if device == None:
+      return False, "Device not connected"
+    if self.last_error != None:
+      return False, self.last_error
+    if self.device != None and device != self.device:
+      return False, "Device was plugged in again"
+    if self.last_write == None:
+      return True, "Nothing written yet"
+    return True, f"Last write {time.monotonic()-self.last_write:.0f} s ago"
+  
+  # Sets current color to the target of a finished transition, or to the last color that was actually written
+  def updateColor(self, finished):
+    if finished and self.target != None:
+      self.color = self.target
+    elif self.last_frame != None:
+      self.color = color(self.last_frame.decode())
+  
+  # Moves on to the next segment of the running cue, collecting any triggers on the way
+  def nextSegment(self, triggers):
+    while self.program != None:
+      segment = next(self.program, None)
+      # Cue is over
+      if segment == None:
+        self.program = None
+        self.cue = None
+      elif isinstance(segment, str):
+        triggers.append(segment)
+      elif len(segment) > 0:
+        self.frames = segment
+        self.position = 0
+        self.target = None
+        return
+  
+  # Writes the next frame, and returns triggers of the running cue that were reached
+  def writeFrame(self):
+    triggers = []
+    if self.frames == None:
+      self.nextSegment(triggers)
+      if self.frames == None:
+        self.port.close()
+        return triggers
     try:
-      # Determines which color to use
-      if target=="base":
-        new_color = config["base-color"]
-      elif target=="hint-bright":
-        new_color = config["hint-color-bright"]
-      elif target=="hint-dark":
-        new_color = config["hint-color-dark"]
-      elif target=="victory":
-        new_color = config["victory-color"]
-      else:
-        print("Declined request to change to invalid color target")
-        new_color = None
-      
-      # Skip changing if new color is the same as the old one
-      if new_color == self.color:
-        new_color = None
-        success = False
-      
-      # Proceed if we decided that we should change colors
-      if new_color != None:
+      frame = self.frames[self.position]
+      # Consecutive identical frames and holds don't need to send anything
+      if frame != None and frame != self.last_frame:
         # Connect to Arduino
-        self.port.open()
-        # Make sure we're only making static-static or rainbow-rainbow transitions
-        if self.color.cltype == new_color.cltype:
-          if hint_transition:
-            total_samples = int(config["samplerate"]*config["hint-transition"])
-          else:
-            total_samples = int(config["samplerate"]*config["transition"])
-          # Static color transition
-          if self.color.cltype == 'S':
-            dR = new_color.red - self.color.red
-            dG = new_color.green - self.color.green
-            dB = new_color.blue - self.color.blue
-            for i in range(1,total_samples+1):
-              r = int(self.color.red + dR*i/total_samples)
-              g = int(self.color.green + dG*i/total_samples)
-              b = int(self.color.blue + dB*i/total_samples)
-              self.port.write(bytes("$S#%02X%02X%02X"%(r,g,b),'utf-8'))
-          # Rainbow color transition
-          elif self.color.cltype == 'H':
-            dV = new_color.value - self.color.value
-            for i in range(1,total_samples+1):
-              v = int(self.color.value + dV*i/total_samples)
-              self.port.write(bytes("$H#%02X"%(v,),'utf-8'))
-            
-        # If changing between two different type color modes, do an instant change.
-        else:
-          self.port.write(new_color.hexbytes)
-          success = False
-        
-        self.color = new_color
-    except FileNotFoundError:
-      print("Could not change LED strip color: Device was disconnected")
-      success = False
-    except PermissionError:
-      print("Could not change LED strip color: Access denied")
-      success = False
+        if not self.port.is_open:
+          self.port.open()
+          self.device = device_id(self.port.port)
+        self.port.write(frame)
+        self.last_frame = frame
+        self.last_write = time.monotonic()
+        self.last_error = None
+      self.position += 1
+      if self.position == len(self.frames):
+        self.updateColor(True)
+        self.frames = None
+        self.nextSegment(triggers)
+        # Disconnect from Arduino once everything is done
+        if self.frames == None:
+          self.port.close()
+      return triggers
     except OSError as e:
-      print("Could not change LED strip color:", end=' ')
-      if e.errno==2:
-        print("Device was disconnected")
-      elif e.errno==13:
-        print("Access denied")
-      else:
-        print(e)
-      success = False
-    except BaseException as e:
-      self.port.close()
-      self.lock.release()
-      raise e
-    # Disconnect from Arduino
+      self.last_error = serial_error(e)
+      print(f"Could not change LED strip '{self.name}' color: {self.last_error}")
+    # Give up on this transition if anything went wrong, but remember its color so that the watchdog
+    # can set it once the device is back. Endless cues (like hint pulsing) wait for the device instead.
+    if self.target != None:
+      self.color = self.target
+    self.frames = None
+    self.last_frame = None
     self.port.close()
-    self.lock.release()
-    return success
-  
-  # Pulses hint color
-  def startHintMode(self):
-    Thread(target=self.__hintModeThread, daemon=True).start()
-  
-  # Thread that handles hint mode pulsing
-  def __hintModeThread(self):
-    self.hintmode_lock.acquire()
-    self.hintmode = True
-    self.hintmode_lock.release()
-    run = True
-    hint_transition = False
-    # Pulses until hint mode is disabled by another thread
-    while run:
-      if not self.change("hint-bright", hint_transition):
-        # If there was no smooth transition or an error happened, wait before next change
-        time.sleep(1)
-      hint_transition = True
-      self.hintmode_lock.acquire()
-      if not self.hintmode:
-        self.hintmode_lock.release()
-        break
-      self.hintmode_lock.release()
-      if not self.change("hint-dark", hint_transition):
-        # Again, if there was no smooth transition or an error happened, wait
-        time.sleep(1)
-      self.hintmode_lock.acquire()
-      run = self.hintmode
-      self.hintmode_lock.release()
-  
-  # Stops pulsing hint colors
-  def stopHintMode(self):
-    self.hintmode_lock.acquire()
-    self.hintmode = False
-    self.hintmode_lock.release()
-
-
-# Screen blanking class
-class screenBlanker(QWidget):
+    if self.cue != None and self.cue.loop == 0:
+      self.offline = True
+    else:
+      self.cue = None
+      self.program = None
+    return triggers
+
+
+# Returns something that identifies a device node, or None if it doesn't exist
+def device_id(path):
+  try:
+    stat = os.stat(path)
+  except OSError:
+    return None
+  return (stat.st_rdev, stat.st_ino, stat.st_ctime_ns)
+
+# Describes a serial port error, for logging and health reports
+def serial_error(e):
+  if e.errno==2:
+    return "Device was disconnected"
+  elif e.errno==13:
+    return "Access denied"
+  return str(e)
+
+
+# Class that holds a lighting cue: a timeline of color keyframes, holds and triggers.
+# Steps are ("color", color or target name, seconds, easing), ("hold", seconds) or ("trigger", command).
+# Steps before loop_start play once, the rest play 'loop' times (0 means forever).
+class cue():
+  def __init__(self, name, steps, loop_start=0, loop=1, priority=0, zones=[], groups=[], on=None):
+    self.name = name
+    self.intro = steps[:loop_start]
+    self.body = steps[loop_start:]
+    self.loop = loop
+    self.priority = priority
+    self.zones = zones
+    self.groups = groups
+    self.on = on
+    self.compiled = dict()
+  
+  # Compiles the cue into frame schedules for the given strip, ahead of time.
+  # The first fade of the cue depends on the color the strip has when the cue starts,
+  # so it's left as a (color, samples, easing) tuple to be computed then.
+  def compile(self, strip):
+    intro, end = compile_steps(self.intro, strip, None)
+    body_first, body_end = compile_steps(self.body, strip, end)
+    if body_end == None or body_end == end:
+      body_repeat = body_first
+    else:
+      body_repeat, _ = compile_steps(self.body, strip, body_end)
+    self.compiled[strip.name] = (intro, body_first, body_repeat)
+  
+  # Yields the compiled segments for a strip, in order.
+  # An endless cue stops after a pass without any frames, since the scheduler would never get to write anything else.
+  def play(self, strip, leader):
+    intro, body_first, body_repeat = self.compiled[strip.name]
+    iteration = 0
+    segments = intro + body_first
+    while True:
+      produced = False
+      for segment in segments:
+        if isinstance(segment, tuple):
+          produced = True
+          yield fade_frames(strip.color, *segment)
+        elif isinstance(segment, str):
+          if leader:
+            yield segment
+        else:
+          produced = produced or len(segment) > 0
+          yield segment
+      iteration += 1
+      if iteration == self.loop:
+        return
+      if not produced and self.loop == 0:
+        print(f"Stopping cue '{self.name}' on '{strip.name}', since it doesn't take any time")
+        return
+      segments = body_repeat
+
+# Turns cue steps into a list of frame lists and trigger commands, starting from the given color (or None if unknown)
+def compile_steps(steps, strip, previous):
+  segments = []
+  for step in steps:
+    if step[0] == "color":
+      target = strip.colors[step[1]] if isinstance(step[1], str) else step[1]
+      samples = int(config.samplerate*step[2])
+      if previous == None:
+        segments.append((target, samples, step[3]))
+      else:
+        segments.append(fade_frames(previous, target, samples, step[3]))
+      previous = target
+    elif step[0] == "hold":
+      # Holds shorter than a sample still last one, so that they give the scheduler a frame to wait on
+      samples = int(config.samplerate*step[1])
+      segments.append([None]*(max(1, samples) if step[1] > 0 else 0))
+    elif step[0] == "trigger":
+      segments.append(step[1])
+  return segments, previous
+
+# Frames for a fade, falling back to an instant change (followed by a hold) between different color types
+def fade_frames(old, new, total_samples, curve=None):
+  if old.cltype == new.cltype:
+    return transition_frames(old, new, total_samples, curve=curve)
+  return [new.hexbytes] + [None]*(total_samples-1)
+
+# Loads a cue file. Raises ValueError with the file and line of the problem if it's invalid.
+def load_cue(path):
+  name = os.path.splitext(os.path.basename(path))[0]
+  steps, settings, loop_start = [], dict(), 0
+  with open(path, 'r') as cue_f:
+    for number, line in enumerate(cue_f.readlines(), 1):
+      line = line.strip()
+      # Skip empty lines and comments
+      if line=="" or line.startswith('#'):
+        continue
+      if line=="loop-start":
+        loop_start = len(steps)
+        continue
+      key, separator, value = line.partition('=')
+      key, value = key.strip(), value.strip()
+      try:
+        if separator=="":
+          raise ValueError("expected 'key=value'")
+        if key=="color":
+          args = value.split()
+          if len(args) not in (2, 3):
+            raise ValueError("expected 'color=<hexcode or color name> <seconds> [easing]'")
+          if args[0].startswith('$'):
+            target = color_value(args[0])
+          elif args[0] in ZONE_TARGETS:
+            target = args[0]
+          else:
+            raise ValueError(f"unknown color '{args[0]}'")
+          curve = args[2] if len(args)==3 else None
+          if curve != None and curve not in EASING_CURVES:
+            raise ValueError(f"unknown easing curve '{curve}'")
+          steps.append(("color", target, float(args[1]), curve))
+        elif key=="hold":
+          steps.append(("hold", float(value)))
+        elif key=="trigger":
+          steps.append(("trigger", value if value.startswith('/') else '/'+value))
+        elif key in ("loop", "priority"):
+          settings[key] = int(value)
+        elif key in ("zone", "group"):
+          settings[key+"s"] = [value]
+        elif key=="on":
+          if value not in ("base", "hint", "victory"):
+            raise ValueError("cues can only replace 'base', 'hint' or 'victory'")
+          settings["on"] = value
+        else:
+          raise ValueError(f"unknown key '{key}'")
+      except ValueError as e:
+        raise ValueError(f"{path}:{number}: {e}")
+  # Cues that loop forever need to take some time, otherwise they would never yield to other strips
+  cue_object = cue(name, steps, loop_start, **settings)
+  if cue_object.loop < 0:
+    raise ValueError(f"{path}: loop count can't be negative")
+  if cue_object.loop == 0 and not any(step[0]=="color" or (step[0]=="hold" and step[1]>0) for step in cue_object.body):
+    raise ValueError(f"{path}: endless cues need at least one color or hold after loop-start")
+  return cue_object
+
+# Loads all cue files from the cue directory. Invalid cues are skipped.
+def load_cues():
+  cues = dict()
+  directory = config.cue_directory
+  if not os.path.isdir(directory):
+    return cues
+  for filename in sorted(os.listdir(directory)):
+    if filename.endswith(".cue"):
+      try:
+        loaded = load_cue(os.path.join(directory, filename))
+        cues[loaded.name] = loaded
+      except (OSError, ValueError) as e:
+        print(f"Skipping invalid cue: {e}")
+  return cues
+
+# Built-in cue that pulses hint colors, used unless a cue file replaces it
+def hint_cue():
+  steps = [("color", "hint-bright", config.transition, None),
+           ("color", "hint-dark", config.hint_transition, None),
+           ("color", "hint-bright", config.hint_transition, None)]
+  return cue("hint", steps, loop_start=1, loop=0, on="hint")
+
+
+# Class that animates all LED strip zones from a single thread
+class stripScheduler():
+  def __init__(self, strips, groups, cues):
+    self.strips = strips
+    self.groups = groups
+    self.cues = cues
+    # Cues that replace the plain base, hint and victory colors
+    self.bindings = {"hint": hint_cue()}
+    for loaded in cues.values():
+      if loaded.on != None:
+        self.bindings[loaded.on] = loaded
+    # Compile all cues for all strips ahead of time
+    for loaded in list(cues.values()) + list(self.bindings.values()):
+      for strip in strips.values():
+        loaded.compile(strip)
+    self.condition = Condition()
+    self.thread = None
+    # Updated on every pass of the scheduler thread, even when it's idle, so that the watchdog can tell it's alive
+    self.heartbeat = time.monotonic()
+  
+  def start(self):
+    self.heartbeat = time.monotonic()
+    self.thread = Thread(target=self.__schedulerThread, daemon=True)
+    self.thread.start()
+  
+  # Returns the health of the scheduler thread, as a tuple of (ok, detail)
+  def health(self):
+    if not self.thread.is_alive():
+      return False, "Scheduler thread stopped"
+    stalled = time.monotonic()-self.heartbeat
+    if stalled > SCHEDULER_STALL:
+      return False, f"Scheduler hasn't run for {stalled:.0f} s"
+    busy = sum(1 for strip in self.strips.values() if strip.busy())
+    return True, f"{busy} of {len(self.strips)} strips busy"
+  
+  # Starts the scheduler thread again if it stopped. A thread that's stuck can't be replaced, since it holds the strips.
+  def restart(self):
+    if self.thread.is_alive():
+      return False
+    print("Restarting LED strip scheduler")
+    self.start()
+    return True
+  
+  # Lets a strip write to its device again, if the device is there
+  def recover(self, strip):
+    if device_id(strip.port.port) == None:
+      return False
+    print(f"Reconnecting to LED strip '{strip.name}'")
+    with self.condition:
+      strip.reconnect()
+      self.condition.notify()
+    return True
+  
+  # Returns the list of strips addressed by the given zone and group names, or None if any name is unknown.
+  # Addressing nothing means addressing all zones.
+  def resolve(self, zone_args, group_args):
+    names = []
+    for arg in zone_args:
+      names += arg.split(',')
+    for arg in group_args:
+      for group in arg.split(','):
+        if group=="all":
+          names += list(self.strips)
+        elif group in self.groups:
+          names += self.groups[group]
+        else:
+          return None
+    if len(names)==0:
+      return list(self.strips.values())
+    if any(name not in self.strips for name in names):
+      return None
+    # Remove duplicates while keeping order
+    return [self.strips[name] for name in dict.fromkeys(names)]
+  
+  # Returns a short description of the addressed zones, for logging
+  def describe(self, strips):
+    if len(strips)==len(self.strips):
+      return ""
+    return f" ({', '.join(strip.name for strip in strips)})"
+  
+  # Switches the given strips to a color target, or plays the cue that replaces it
+  def trigger(self, strips, target):
+    if target in self.bindings:
+      self.startCue(strips, self.bindings[target], restart=False)
+    else:
+      self.change(strips, target)
+  
+  # Transitions the given strips to the specified color target
+  def change(self, strips, target):
+    with self.condition:
+      for strip in strips:
+        strip.startTransition(target)
+      self.condition.notify()
+  
+  # Starts a cue on the given strips. Cues with a higher priority that are already playing aren't preempted.
+  def startCue(self, strips, cue, restart=True):
+    with self.condition:
+      leader = True
+      for strip in strips:
+        if strip.cue != None and (strip.cue.priority > cue.priority or (strip.cue == cue and not restart)):
+          continue
+        strip.startCue(cue, leader)
+        leader = False
+      self.condition.notify()
+  
+  # Stops cues on the given strips, leaving them on their current color
+  def stopCue(self, strips):
+    with self.condition:
+      for strip in strips:
+        if strip.cue != None:
+          strip.stop()
+  
+  # Writes one frame to every busy strip on each tick, paced by the configured sample rate
+  def __schedulerThread(self):
+    interval = 1/config.samplerate
+    next_tick = time.monotonic()
+    while True:
+      triggers = []
+      with self.condition:
+        self.heartbeat = time.monotonic()
+        ready = [strip for strip in self.strips.values() if strip.busy() and not strip.offline]
+        # Sleep until there's work to do, waking up now and then to show that we're alive
+        if len(ready)==0:
+          self.condition.wait(HEALTH_INTERVAL)
+          next_tick = time.monotonic()
+          continue
+        for strip in ready:
+          triggers += strip.writeFrame()
+      # Triggers may start other cues, so they run after the strips are released
+      for command in triggers:
+        url = urlparse(command)
+        if run_command(url.path, parse_qs(url.query))==False:
+          print(f"Cue trigger '{command}' is invalid")
+      # Don't try to catch up if writing took longer than a tick
+      next_tick = max(next_tick+interval, time.monotonic())
+      time.sleep(max(0, next_tick-time.monotonic()))
+
+
+# Returns the color set of a zone, falling back to the main colors for anything the zone doesn't set
+def zone_colors(name):
+  zone = config.zones.get(name, dict())
+  return {"base": zone.get("base-color", config.base_color),
+          "hint-bright": zone.get("hint-color-bright", config.hint_color_bright),
+          "hint-dark": zone.get("hint-color-dark", config.hint_color_dark),
+          "victory": zone.get("victory-color", config.victory_color)}
+
+
+# Class that injects keystrokes into the X session.
+# The XTest connection is opened once at startup, so that keystrokes don't need to start any new processes.
+class keyInjector():
   def __init__(self):
-    super().__init__()
-    self.active = False
-  # Track if screen is blanked or not
-  def showEvent(self, e):
-    self.active = True
-    self.setWindowState(self.windowState() | Qt.WindowFullScreen)
-  def hideEvent(self, e):
-    # If the screen was blanked, ask the desktop manager to lock the session.
-    if self.active:
-      # We should try to lock the screen after hiding the screen blanking window
+    self.lock = Lock()
+    self.display = None
+    # Keystrokes are injected through XTest when python-xlib is available, otherwise xdotool is used.
+    # The Xlib modules are kept with the connection they're used with.
+    try:
+      from Xlib import X, XK
+      from Xlib.display import Display
+      from Xlib.ext import xtest
+    except ModuleNotFoundError:
+      print("python-xlib is not installed, keystrokes will be sent with xdotool")
+      return
+    self.X, self.XK, self.xtest = X, XK, xtest
+    try:
+      self.display = Display()
+      if not self.display.has_extension("XTEST"):
+        raise RuntimeError("XTEST extension is not available")
+    except Exception as e:
+      print(f"Could not connect to X server for keystrokes, they will be sent with xdotool: {e}")
+      self.display = None
+  
+  # Presses a sequence of keys, where each key can be a combination like 'ctrl+Right'. Returns False if a key name is invalid.
+  def press(self, keys):
+    if any(not KEY_PATTERN.fullmatch(key) for key in keys):
+      return False
+    if self.display == None:
+      subprocess.Popen(["xdotool", "key"] + keys)
+      return True
+    with self.lock:
+      # Find all key codes first, so that an invalid key doesn't leave other keys pressed
+      combinations = []
+      for key in keys:
+        codes = [self.display.keysym_to_keycode(self.XK.string_to_keysym(KEY_ALIASES.get(name, name))) for name in key.split('+')]
+        if 0 in codes:
+          return False
+        combinations.append(codes)
+      for codes in combinations:
+        for code in codes:
+          self.xtest.fake_input(self.display, self.X.KeyPress, code)
+        for code in reversed(codes):
+          self.xtest.fake_input(self.display, self.X.KeyRelease, code)
+      self.display.sync()
+    return True
+  
+  # Returns the health of keystroke injection, as a tuple of (ok, detail)
+  def health(self):
+    if self.display != None:
+      return True, "XTest"
+    if shutil.which("xdotool") == None:
+      return False, "Neither python-xlib nor xdotool is available"
+    return True, "xdotool"
+
+
+# Light sender for the web operator panel's game engine. Commands run right here instead of going through
+# an HTTP request, one at a time and in the order they were sent.
+class localLights():
+  def __init__(self):
+    self.queue = Queue()
+    Thread(target=self.__commandThread, daemon=True).start()
+  
+  def send(self, command):
+    self.queue.put(command)
+  
+  # The health report is right here, so there's no need to ask for it over HTTP
+  def health(self):
+    return game_core.health_summary(monitor.report())
+  
+  def __commandThread(self):
+    while True:
+      url = urlparse("/"+self.queue.get())
+      result = run_command(url.path, parse_qs(url.query))
+      if result==None:
+        panel.lightError("Server is still starting")
+      elif not result:
+        panel.lightError("Invalid request")
+
+
+# Class that connects one web operator panel to the game engine, over a WebSocket.
+# Engine events are queued by the engine's threads and sent by a writer thread, so a slow browser never holds up the game.
+# Timer updates replace each other when the browser can't keep up, since each one holds the whole state.
+class panelConnection():
+  def __init__(self, rfile, wfile):
+    self.rfile = rfile
+    self.wfile = wfile
+    self.condition = Condition()
+    self.frames = []
+    self.state = None
+    self.closed = False
+  
+  # Serves the connection until it's closed
+  def run(self):
+    panel.subscribe(game_core.stateEvent, self.stateChanged)
+    panel.subscribe(game_core.tickEvent, self.stateChanged)
+    panel.subscribe(game_core.historyEvent, self.historyAdded)
+    panel.subscribe(game_core.healthEvent, self.healthChanged)
+    self.queue(1, json.dumps({"type": "hello", "slideshows": game_core.SLIDESHOWS, "history": panel.historyLines()}))
+    if panel.health != None:
+      self.healthChanged(panel.health)
+    panel.refresh()
+    writer = Thread(target=self.__writerThread, daemon=True)
+    writer.start()
+    try:
+      self.__readMessages()
+    except (OSError, ValueError):
+      pass
+    finally:
+      panel.unsubscribe(game_core.stateEvent, self.stateChanged)
+      panel.unsubscribe(game_core.tickEvent, self.stateChanged)
+      panel.unsubscribe(game_core.historyEvent, self.historyAdded)
+      panel.unsubscribe(game_core.healthEvent, self.healthChanged)
+      with self.condition:
+        self.closed = True
+        self.condition.notify()
+      # Let the writer send what's left, like the close frame, before the connection is closed
+      writer.join(WEBSOCKET_KEEPALIVE)
+  
+  def stateChanged(self, event):
+    message = json.dumps({"type": "state", "start": event.start, "pause": event.pause, "hints": event.hints,
+                          "time": event.time, "time_str": event.time_str, "score": event.score})
+    with self.condition:
+      self.state = websocket_frame(1, message.encode())
+      self.condition.notify()
+  
+  def historyAdded(self, event):
+    self.queue(1, json.dumps({"type": "history", "html": event.html}))
+  
+  def healthChanged(self, event):
+    self.queue(1, json.dumps({"type": "health", "ok": event.ok, "detail": event.detail}))
+  
+  # Queues a frame to be sent
+  def queue(self, opcode, payload):
+    if isinstance(payload, str):
+      payload = payload.encode()
+    with self.condition:
+      self.frames.append(websocket_frame(opcode, payload))
+      self.condition.notify()
+  
+  # Reads messages from the browser and runs the actions they ask for
+  def __readMessages(self):
+    message = b""
+    while True:
+      head = self.__read(2)
+      fin, opcode, masked, length = head[0]&0x80, head[0]&0x0F, head[1]&0x80, head[1]&0x7F
+      if length==126:
+        length = int.from_bytes(self.__read(2), "big")
+      elif length==127:
+        length = int.from_bytes(self.__read(8), "big")
+      # Browsers always mask their frames
+      if not masked or length+len(message)>WEBSOCKET_MAX_MESSAGE:
+        self.queue(8, (1002).to_bytes(2, "big"))
+        return
+      mask = self.__read(4)
+      payload = bytes(b^mask[i%4] for i, b in enumerate(self.__read(length)))
+      # Close
+      if opcode==8:
+        self.queue(8, payload[:2])
+        return
+      # Ping
+      elif opcode==9:
+        self.queue(10, payload)
+      # Text message, or its continuation
+      elif opcode in (0, 1):
+        message += payload
+        if fin:
+          self.runAction(json.loads(message))
+          message = b""
+  
+  def __read(self, length):
+    data = self.rfile.read(length)
+    if len(data)<length:
+      raise ConnectionError("connection closed")
+    return data
+  
+  def runAction(self, message):
+    if not isinstance(message, dict):
+      return
+    action = message.get("action")
+    if action in PANEL_ACTIONS:
+      getattr(panel, action)()
+    elif action=="sendSlideshow" and message.get("name") in game_core.SLIDESHOWS:
+      panel.sendSlideshow(message["name"])
+  
+  def __writerThread(self):
+    while True:
+      with self.condition:
+        if len(self.frames)==0 and self.state==None and not self.closed:
+          # Ping when there's nothing else to send
+          if not self.condition.wait(WEBSOCKET_KEEPALIVE):
+            self.frames.append(websocket_frame(9, b""))
+        frames = self.frames
+        if self.state!=None:
+          frames.append(self.state)
+        self.frames, self.state = [], None
+        closed = self.closed
       try:
-        print("Showing lock screen")
-        subprocess.run(["qdbus", "org.freedesktop.ScreenSaver", "/ScreenSaver", "org.freedesktop.ScreenSaver.SetActive", "true"], timeout=15)
-      except BaseException as e:
-        print(f"Couldn't lock session: {e}")
-    self.active = False
+        for frame in frames:
+          self.wfile.write(frame)
+          # Nothing is sent after a close frame
+          if frame[0]==0x88:
+            return
+      except OSError:
+        return
+      if closed:
+        return
+
+
+# Builds an unmasked WebSocket frame, as sent by servers
+def websocket_frame(opcode, payload):
+  if len(payload)<126:
+    head = bytes((0x80|opcode, len(payload)))
+  elif len(payload)<65536:
+    head = bytes((0x80|opcode, 126)) + len(payload).to_bytes(2, "big")
+  else:
+    head = bytes((0x80|opcode, 127)) + len(payload).to_bytes(8, "big")
+  return head+payload
+
+
+# Starts the game engine of the web operator panel. Runs in the background, like the LED strips.
+def init_panel(report):
+  global panel, game_core
+  import game_core
+  report.mark("game core imported")
+  directory = config.panel_directory
+  error = game_core.load_config(os.path.join(directory, game_core.CONFIG_PATH))
+  if error!=None:
+    print(f"Could not load the creator panel's configuration from '{directory}', the operator panel is disabled:\n{error}")
+    panel_ready.set()
+    report.done("panel")
+    return
+  panel = game_core.gameEngine(game_core.config, localLights(), directory)
+  try:
+    panel.start()
+  except game_core.engineBusy as e:
+    print(f"{e}, the operator panel is disabled")
+    panel = None
+  panel_ready.set()
+  report.done("panel")
+
+
+# Class that keeps track of the health of the server's parts, and restarts the ones that stopped working.
+# Each part registers a check that returns a tuple of (ok, detail), and optionally a function that restarts it.
+# Checks run in the watchdog's own thread, so a part that hangs can't keep the others from being checked.
+class healthMonitor():
+  def __init__(self):
+    self.lock = Lock()
+    self.checks = dict()
+    self.results = dict()
+    self.started = time.monotonic()
+  
+  def register(self, name, check, restart=None):
+    with self.lock:
+      self.checks[name] = (check, restart)
+      self.results[name] = {"ok": None, "detail": "Starting", "since": time.time(), "restarts": 0}
+  
+  def start(self):
+    Thread(target=self.__watchdogThread, daemon=True).start()
+  
+  # Returns the latest results of all checks. The server is healthy once every check passed.
+  def report(self):
+    with self.lock:
+      checks = {name: dict(result) for name, result in self.results.items()}
+    return {"ok": all(result["ok"] for result in checks.values()), "uptime": round(time.monotonic()-self.started), "checks": checks}
+  
+  def __watchdogThread(self):
+    while True:
+      with self.lock:
+        checks = list(self.checks.items())
+      for name, (check, restart) in checks:
+        try:
+          ok, detail = check()
+        except Exception as e:
+          ok, detail = False, str(e)
+        with self.lock:
+          result = self.results[name]
+          changed = result["ok"] != ok
+          if changed:
+            result["since"] = time.time()
+          result["ok"], result["detail"] = ok, detail
+        if changed and ok:
+          print(f"{name} is working again")
+        elif changed:
+          print(f"\033[93m{name} isn't working: {detail}\033[0m")
+        # Try to bring failed parts back
+        if not ok and restart != None:
+          try:
+            if restart():
+              with self.lock:
+                result["restarts"] += 1
+          except Exception as e:
+            print(f"Could not restart {name}: {e}")
+      time.sleep(HEALTH_INTERVAL)
+
+
+# Class that runs the HTTP server's loop in a thread, and checks that it still answers requests
+class serverThread():
+  def __init__(self, server):
+    self.server = server
+    self.thread = None
+  
+  def start(self):
+    self.thread = Thread(target=self.server.serve_forever, daemon=True)
+    self.thread.start()
+  
+  # Makes a request to ourselves, like a client would
+  def health(self):
+    host, port = self.server.server_address[:2]
+    if host in ("", "0.0.0.0"):
+      host = "127.0.0.1"
+    begin = time.perf_counter()
+    comms = HTTPConnection(host, port, timeout=HEALTH_TIMEOUT)
+    try:
+      comms.request('GET', "/health/ping")
+      status = comms.getresponse().status
+    finally:
+      comms.close()
+    return status==200, f"Answered in {(time.perf_counter()-begin)*1000:.1f} ms"
+  
+  def restart(self):
+    if self.thread.is_alive():
+      return False
+    print("Restarting HTTP server")
+    self.start()
+    return True
+
+
+# Class that keeps track of how long each part of startup takes, and prints a report once everything is ready
+class startupReport():
+  def __init__(self, parts):
+    self.lock = Lock()
+    self.steps = []
+    self.pending = set(parts)
+  
+  # Records that a step was completed
+  def mark(self, step):
+    with self.lock:
+      self.steps.append((time.perf_counter()-STARTUP_TIME, step))
+  
+  # Records that one of the parts started in parallel is ready, and prints the report after the last one
+  def done(self, part):
+    self.mark(f"{part} ready")
+    with self.lock:
+      self.pending.discard(part)
+      if len(self.pending)>0:
+        return
+      print("\033[4mStartup time report:\033[0m")
+      for elapsed, step in sorted(self.steps):
+        print(f"{elapsed*1000:8.1f} ms  {step}")
+      print()
+
+
+# Waits for a part of the server that is still starting up. Returns False if it didn't become ready in time.
+def wait_ready(part):
+  return part.wait(STARTUP_WAIT)
+
+
+# Connects to the LED strips. Runs in the background, so that the server doesn't wait for the serial ports.
+def init_lights(report):
+  global serial, lights
+  import serial
+  report.mark("pyserial imported")
+  # Connect to Arduino LED strips
+  print("Connecting to LED strips")
+  strips = {MAIN_ZONE: ledstrip(MAIN_ZONE, config.serial, zone_colors(MAIN_ZONE))}
+  for name, zone in config.zones.items():
+    strips[name] = ledstrip(name, zone["serial"], zone_colors(name))
+  # Exit if no strip could be connected to. The Qt event loop is running in the main thread, so exit right away.
+  if not any(strip.init_success for strip in strips.values()):
+    os._exit(3)
+  report.mark("LED strips connected")
+  cues = load_cues()
+  if len(cues)>0:
+    print(f"Loaded cues: {', '.join(cues)}")
+  lights = stripScheduler(strips, config.groups, cues)
+  lights.start()
+  monitor.register("scheduler", lights.health, lights.restart)
+  for name, strip in strips.items():
+    monitor.register(f"serial:{name}", strip.health, lambda strip=strip: lights.recover(strip))
+  lights_ready.set()
+  report.done("lights")
 
 
 def main():
-  global strip, blanker
-  app = QApplication()
-  app.setQuitOnLastWindowClosed(False)
+  global display, slideshow, keyboard, monitor
   # Fix Ctrl+C functionality
   signal.signal(signal.SIGINT, signal.SIG_DFL)
   # Load config file
-  if load_config():
+  error = load_config()
+  if error==None:
     print("\033[4mLoaded following configuration values:\033[0m")
     for i in config.items():
       # If this is a color value, color the text.
@@ -424,36 +1356,64 @@ def main():
     print()
   # Print error message if config file is invalid
   else:
-    print("Could not load configuration file; it might be missing, invalid or incomplete.")
+    print(f"Could not load configuration file: {error}")
     print(f"Configuration file should be named '{CONFIG_PATH}', located in the directory where\nthe script is run, and needs to have this format and values (without parentheses):\n")
-    print("base-color= $(S for static color or H for rainbow)#(Hex value color)")
-    print("hint-color-bright= $(S for static color or H for rainbow)#(Hex value color)")
-    print("hint-color-dark= $(S for static color or H for rainbow)#(Hex value color)")
-    print("hint-transition= (Number of seconds, can be a decimal number. Used for transition between bright and dark hint color)")
-    print("victory-color= $(S for static color or H for rainbow)#(Hex value color)")
-    print("transition= (Number of seconds, can be a decimal number)")
-    print("hostname= (Address from which the server should listen. This should be your device's internal IP address)")
-    print("port= (Network port for the server to listen to. This should be an integer between 0-65535 inclusive)")
-    print("serial= (Path to serial port that connects to an Arduino controlling an LED strip)")
-    print("baudrate= (Integer that indicates what baud rate to use for serial communication with the Arduino)")
-    print("samplerate= (Integer that indicates how many color samples per second are sent to the LED strip during transitions)")
-    print("slideshow8.1-path = (Path to slideshow for hint 8.1)")
-    print("slideshow8.2-path = (Path to slideshow for hint 8.2)")
+    required, optional = CONFIG_SCHEMA.help()
+    for key, description in required:
+      print(f"{key}= ({description})")
+    print("\nOptional values:")
+    for key, description in optional:
+      print(f"{key}= ({description})")
+    print(f"\nValues can be overridden by '*.conf' files in '{CONFIG_PATH}.d', which are read in alphabetical order.")
     sys.exit(1)
+  # The operator panel is only started if it's enabled
+  report = startupReport(("lights", "display", "panel") if config.panel_directory!=None else ("lights", "display"))
+  report.mark("configuration loaded")
   
-  # Create screen blanking object
-  blanker = screenBlanker()
-  # Connect to Arduino LED strip
-  print("Connecting to LED strip")
-  strip = ledstrip()
-  # Exit if connection was unsuccessful
-  if not strip.init_success:
-    sys.exit(3)
-  # Start HTTP Server
+  # Start HTTP Server first, so that clients can connect while everything else starts.
+  # Requests wait until the parts of the server they need are ready.
   print("Starting server")
-  server = HTTPServer((config['hostname'],config['port']),RequestHandler)
+  monitor = healthMonitor()
+  server = ThreadingHTTPServer((config.hostname,config.port),RequestHandler)
+  server.daemon_threads = True
   # Activate server
-  Thread(target=server.serve_forever, daemon=True).start()
+  http_thread = serverThread(server)
+  http_thread.start()
+  monitor.register("http", http_thread.health, http_thread.restart)
+  monitor.start()
+  report.mark("HTTP server listening")
+  # Serial ports are opened in the background, while Qt starts in the main thread
+  Thread(target=init_lights, args=(report,), daemon=True).start()
+  if config.panel_directory!=None:
+    Thread(target=init_panel, args=(report,), daemon=True).start()
+  
+  from PySide2.QtWidgets import QApplication
+  from PySide2.QtCore import QTimer
+  import light_control_qt
+  report.mark("PySide2 imported")
+  app = QApplication()
+  app.setQuitOnLastWindowClosed(False)
+  report.mark("QApplication created")
+  # Create screen blanking object, with its connection to the session's screen saver
+  display = light_control_qt.displayBridge(light_control_qt.screenBlanker(light_control_qt.screenLocker()))
+  # Start rendering slideshows in the background
+  cache = light_control_qt.slideshowCache({name: getattr(config, attribute) for name, attribute in SLIDESHOWS.items()}, app.primaryScreen().size(), config.slideshow_cache)
+  slideshow = light_control_qt.slideshowWindow(cache)
+  cache.start()
+  # Connect to X server for keystrokes
+  keyboard = keyInjector()
+  # Watch the Qt parts of the server
+  loop_probe = light_control_qt.loopProbe()
+  monitor.register("qt-loop", loop_probe.health)
+  monitor.register("screen-lock", display.blanker.locker.health, display.blanker.locker.restart)
+  monitor.register("slideshows", cache.health, cache.restart)
+  monitor.register("keyboard", keyboard.health)
+  report.mark("display objects created")
+  # The display is ready once the event loop is running
+  def displayReady():
+    display_ready.set()
+    report.done("display")
+  QTimer.singleShot(0, displayReady)
   sys.exit(app.exec_())
 
 if __name__=="__main__":
@@ -1,5 +1,7 @@
 const update_interval = 2000 // (ms) Interval on which to poll the server for information
-var data,start=0,stop,hints,pause,time=0;
+const state_server = "" // Address of the creator panel's state server (like "http://192.168.1.2:8081"). Leave empty to poll getdata.php instead
+const state_wait = 25 // (s) How long the state server should hold a request open while nothing changes, for browsers without EventSource
+var data,start=0,stop,hints,pause,time=0,version=0;
 
 var receiver = new XMLHttpRequest();
 var hintsBox = document.getElementById('hints');
@@ -49,11 +51,58 @@ function update_time() {
   updateTimer();
 }
 
-// Poll the server for information on an interval
-setInterval(function() {
-  receiver.open('GET',"getdata.php");
-  receiver.send();
-},update_interval);
+// Process state sent by the creator panel
+function processState(text) {
+  data    = JSON.parse(text);
+  version = data.version;
+  start   = data.start;
+  stop    = data.stop;
+  hints   = data.hints;
+  pause   = data.pause;
+  hintsBox.innerHTML = "Hints: " + hints; // Update hints
+}
+
+// Wait for state changes from the creator panel. The server answers right away when there's
+// a newer version than ours, otherwise it holds the request and answers with 304 if nothing changed.
+function waitForState() {
+  var request = new XMLHttpRequest();
+  request.onreadystatechange = function() {
+    if (request.readyState!=4)
+      return;
+    var ok = request.status==304;
+    if (request.status==200) {
+      try {
+        processState(request.responseText);
+        ok = true;
+      } catch (e) {
+        // Unreadable answer, handled like an unreachable server
+      }
+    }
+    // Try again later if the server couldn't be reached
+    if (ok)
+      waitForState();
+    else
+      setTimeout(waitForState,update_interval);
+  };
+  request.open('GET',state_server+"/state?since="+version+"&wait="+state_wait);
+  request.send();
+}
+
+if (state_server!="" && window.EventSource) {
+  // Get pushed every state change. EventSource reconnects by itself if the connection drops.
+  var events = new EventSource(state_server+"/events");
+  events.addEventListener('state', function(e) {
+    processState(e.data);
+  });
+} else if (state_server!="") {
+  waitForState();
+} else {
+  // Poll the server for information on an interval
+  setInterval(function() {
+    receiver.open('GET',"getdata.php");
+    receiver.send();
+  },update_interval);
+}
 
 // Update timer every second
 setInterval(update_time,1000);
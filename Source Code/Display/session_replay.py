@@ -0,0 +1,257 @@
+#!/bin/python3
+# Replays games recorded by the creator panel's journal (session_*.log files, or journal.log for the game in progress).
+# It can re-drive the display's state files, the score and the light control server, at any speed and from any point in time.
+import os, sys, time, math, json, bisect, argparse
+from http.client import HTTPConnection
+from game_core import game_time, time_string, score, strip_html
+
+# Number of events between snapshots, when building an index for a journal that doesn't have one
+SNAPSHOT_EVERY = 50
+# Seconds between display updates while waiting for the next event
+TICK = 0.5
+
+
+# Parses a time given as seconds or as [h:]mm:ss
+def parse_time(text):
+  seconds = 0
+  for part in text.split(':'):
+    seconds = seconds*60 + float(part)
+  return seconds
+
+
+# Reads events from a journal, starting at the given byte offset. Incomplete or corrupted lines are skipped.
+def read_events(path, offset=0):
+  with open(path, "rb") as journal_f:
+    journal_f.seek(offset)
+    for line in journal_f:
+      try:
+        yield json.loads(line)
+      except ValueError:
+        continue
+
+# Loads the snapshot index of a journal, or builds one if it's missing or doesn't belong to this journal
+def load_index(path):
+  index = []
+  if os.path.exists(path+".idx"):
+    with open(path+".idx", "r") as index_f:
+      for line in index_f:
+        try:
+          index.append(json.loads(line))
+        except ValueError:
+          continue
+    if len(index)==0 or index[-1]["offset"] <= os.path.getsize(path):
+      return index
+    index = []
+  snapshot = {"events": 0, "state": None, "light": None, "history": 0}
+  offset = 0
+  with open(path, "rb") as journal_f:
+    for line in journal_f:
+      offset += len(line)
+      try:
+        event = json.loads(line)
+      except ValueError:
+        continue
+      track(snapshot, event)
+      if snapshot["events"] % SNAPSHOT_EVERY == 0:
+        index.append(dict(snapshot, t=event["t"], offset=offset))
+  # Keep the index for next time
+  try:
+    with open(path+".idx", "w") as index_f:
+      for entry in index:
+        index_f.write(json.dumps(entry, separators=(',', ':'))+"\n")
+  except OSError:
+    pass
+  return index
+
+# Keeps a snapshot up to date with an event, the same way the creator panel's journal does
+def track(snapshot, event):
+  snapshot["events"] += 1
+  if event["type"] == "state":
+    snapshot["state"] = (event["start"], event["pause"], event["hints"])
+  elif event["type"] == "light":
+    snapshot["light"] = event["command"]
+  elif event["type"] == "history":
+    snapshot["history"] += 1
+
+
+# Splits an address given as host:port. Raises ValueError if it isn't one.
+def parse_address(text):
+  host, separator, port = text.rpartition(':')
+  port = int(port)
+  if separator=="" or host=="" or port<0 or port>65535:
+    raise ValueError(f"invalid address '{text}'")
+  return host, port
+
+
+# Class that sends recorded commands to the light control server, and keeps track of how long they take
+class lightSender():
+  def __init__(self, host, port):
+    self.host = host
+    self.port = port
+    self.latencies = []
+
+  def send(self, command):
+    begin = time.perf_counter()
+    try:
+      comms = HTTPConnection(self.host, self.port, timeout=20)
+      comms.request('GET', "/"+command)
+      comms.getresponse().read()
+      comms.close()
+      self.latencies.append(time.perf_counter()-begin)
+    except OSError as e:
+      print(f"Couldn't connect to light control server: {e}")
+
+  # Prints latency statistics, useful when replaying sessions to test the light pipeline
+  def report(self):
+    if len(self.latencies)==0:
+      return
+    latencies = sorted(self.latencies)
+    print(f"Light commands: {len(latencies)}, latency min {latencies[0]*1000:.1f} ms, "
+          f"median {latencies[len(latencies)//2]*1000:.1f} ms, max {latencies[-1]*1000:.1f} ms")
+
+
+# Class that replays one recorded session
+class sessionPlayer():
+  def __init__(self, path, speed, display_dir=None, light_sender=None):
+    self.path = path
+    self.speed = speed
+    self.display_dir = display_dir
+    self.light_sender = light_sender
+    self.index = load_index(path)
+    self.state = (0, 0, 0)
+    self.light = None
+    self.first_time = None
+    for event in read_events(path):
+      self.first_time = event["t"]
+      break
+
+  # Replays the session from 'seek' seconds after it began, until 'until' seconds (or the end)
+  def play(self, seek=0, until=None):
+    if self.first_time == None:
+      print("Session is empty")
+      return
+    target = self.first_time + seek
+    # Start from the last snapshot before the seek target, instead of reading the whole session
+    position = bisect.bisect_right([entry["t"] for entry in self.index], target)
+    offset = 0
+    if position > 0:
+      snapshot = self.index[position-1]
+      offset = snapshot["offset"]
+      if snapshot["state"] != None:
+        self.state = tuple(snapshot["state"])
+      self.light = snapshot["light"]
+    virtual = target
+    caught_up = False
+    for event in read_events(self.path, offset):
+      if until != None and event["t"] > self.first_time + until:
+        break
+      # Events before the seek target only update the state
+      if event["t"] < target:
+        self.apply(event, quiet=True)
+        continue
+      if not caught_up:
+        self.catchUp(virtual)
+        caught_up = True
+      virtual = self.wait(virtual, event["t"])
+      self.apply(event)
+    if not caught_up:
+      self.catchUp(virtual)
+    # Show the final state
+    t = game_time(self.state[0], self.state[1], virtual)
+    print(f"End of replay: time {time_string(t)}, hints {self.state[2]}, score {score(t, self.state[2])}")
+    if self.light_sender != None:
+      self.light_sender.report()
+
+  # Brings the display and lights to where the session was at the seek target
+  def catchUp(self, virtual):
+    print(f"Starting at {time_string(game_time(self.state[0], self.state[1], virtual))} game time")
+    self.updateDisplay(virtual)
+    if self.light != None and self.light_sender != None:
+      self.light_sender.send(self.light)
+
+  # Waits until the next event is due, updating the display while the timer runs
+  def wait(self, virtual, until):
+    while virtual < until:
+      if self.speed <= 0:
+        return until
+      step = min(until-virtual, TICK*self.speed)
+      time.sleep(step/self.speed)
+      virtual += step
+      if self.state[0] > 0 and self.state[1] == 0:
+        self.updateDisplay(virtual)
+    return virtual
+
+  def apply(self, event, quiet=False):
+    if event["type"] == "state":
+      self.state = (event["start"], event["pause"], event["hints"])
+    elif event["type"] == "light":
+      self.light = event["command"]
+    if quiet:
+      return
+    t = game_time(self.state[0], self.state[1], event["t"])
+    if event["type"] == "history":
+      print(f"[{time_string(t)}] {strip_html(event['html'])}")
+    elif event["type"] == "state":
+      print(f"[{time_string(t)}] Timer {'stopped' if self.state[0]<=0 else ('paused' if self.state[1]!=0 else 'running')}, hints {self.state[2]}, score {score(t, self.state[2])}")
+      self.updateDisplay(event["t"])
+    elif event["type"] == "light" and self.light_sender != None:
+      self.light_sender.send(event["command"])
+    elif event["type"] == "reset":
+      print(f"[{time_string(t)}] Game ended with score {event['score']}")
+
+  # Writes state files for displays, shifted so that they show the game time the session had at the given moment
+  def updateDisplay(self, virtual):
+    if self.display_dir == None:
+      return
+    start, pause, hints = self.state
+    now = math.floor(time.time()*10)
+    elapsed = game_time(self.state[0], self.state[1], virtual)
+    if start<=0:
+      values = (start, pause, hints)
+    elif pause==0:
+      values = (now-elapsed, 0, hints)
+    else:
+      values = (now-elapsed, now, hints)
+    try:
+      for name, value in zip(("start.txt", "pause.txt", "hints.txt"), values):
+        with open(os.path.join(self.display_dir, name), "w") as value_f:
+          value_f.write(str(value))
+    except OSError as e:
+      print(f"Couldn't update display: {e}")
+
+
+def main():
+  parser = argparse.ArgumentParser(description="Replays a game session recorded by the creator panel.")
+  parser.add_argument("session", help="Session file to replay (session_*.log, or journal.log for the current game)")
+  parser.add_argument("--speed", type=float, default=1, help="Replay speed multiplier. 0 replays as fast as possible")
+  parser.add_argument("--seek", default="0", help="Where to start, as seconds or [h:]mm:ss since the session began")
+  parser.add_argument("--until", default=None, help="Where to stop, as seconds or [h:]mm:ss since the session began")
+  parser.add_argument("--display-dir", default=None, help="Directory to write start.txt, pause.txt and hints.txt to, for displays")
+  parser.add_argument("--light-server", default=None, help="Address of a light control server to send recorded light commands to, as host:port")
+  args = parser.parse_args()
+
+  if not os.path.exists(args.session):
+    print(f"Session file '{args.session}' doesn't exist")
+    sys.exit(1)
+  try:
+    seek = parse_time(args.seek)
+    until = parse_time(args.until) if args.until != None else None
+  except ValueError:
+    print("Invalid time given to --seek or --until")
+    sys.exit(1)
+  light_sender = None
+  if args.light_server != None:
+    try:
+      light_sender = lightSender(*parse_address(args.light_server))
+    except ValueError:
+      print("Invalid address given to --light-server, it should be host:port")
+      sys.exit(1)
+  player = sessionPlayer(args.session, args.speed, args.display_dir, light_sender)
+  try:
+    player.play(seek, until)
+  except KeyboardInterrupt:
+    pass
+
+# Redirects to main
+if __name__=="__main__":
+  main()